@@ -1,11 +1,13 @@
 import os
-import io
-import base64
 import asyncio
-from typing import Optional
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from PIL import Image
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Optional
+import time
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 from huggingface_hub import hf_hub_download
 import logging
 
@@ -22,7 +24,21 @@ NATURALIA_DIR = VENDORED
 if str(NATURALIA_DIR) not in sys.path:
     sys.path.insert(0, str(NATURALIA_DIR))
 
-from inference import Inference
+# The ONNX backend imports neither torch nor timm, so choose before importing either
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch').lower()
+if INFERENCE_BACKEND == 'onnx':
+    from onnx_backend import OnnxInference, TopK
+    from image_io import decode_image
+else:
+    from inference import Inference, TopK, share_model_memory
+    # Decodes JPEGs straight to uint8 tensors for the batched tensor preprocessing
+    from preprocess import decode_to_tensor as decode_image
+from batching import MicroBatcher, QueueFull
+from download_model import convert_checkpoint, inference_weights_path
+from image_io import ImageFetcher, ImageTooLarge, MultipartImage, TooManyImages, decode_base64, read_stream
+from prediction_cache import PredictionCache
+from cpu_tuning import available_cpus, configure_torch_threads
+import metrics
 
 app = FastAPI(title="iNat Vision Service")
 logging.basicConfig(level=logging.INFO)
@@ -34,30 +50,263 @@ MODEL_FILE = os.environ.get('HF_MODEL_FILE', 'inat_sgd_6k.pth')
 CFG_FILE = os.environ.get('HF_CONFIG_FILE', 'MetaFG_2_384_inat.yaml')
 NAMES_FILE = os.environ.get('HF_NAMES_FILE', 'inat_sgd_names.txt')
 HUGGINGFACE_TOKEN = os.environ.get('HUGGINGFACE_TOKEN')
+# Serve from an inference-only copy of the weights (written once next to MODEL_FILE) that is
+# memory-mapped at load time instead of unpickling the full training checkpoint
+CONVERT_WEIGHTS = os.environ.get('CONVERT_WEIGHTS', '').lower() in ('1', 'true', 'yes')
+# Run the nn.Linear layers as dynamically quantized int8 (CPU); see check_quantization.py for the accuracy cost
+QUANTIZE_INT8 = os.environ.get('QUANTIZE_INT8', '').lower() in ('1', 'true', 'yes')
+# INFERENCE_BACKEND=onnx runs a graph written by export_onnx.py with onnxruntime instead of PyTorch
+ONNX_MODEL_FILE = os.environ.get('ONNX_MODEL_FILE', Path(MODEL_FILE).stem + '.onnx')
+# 0 = the CPU budget from configure_threads
+ONNX_INTRA_OP_THREADS = int(os.environ.get('ONNX_INTRA_OP_THREADS', '0'))
+ONNX_INTER_OP_THREADS = int(os.environ.get('ONNX_INTER_OP_THREADS', '0'))
+# Fold BatchNorm into the preceding convolutions of the stem and MBConv stages at load time
+FUSE_CONV_BN = os.environ.get('FUSE_CONV_BN', '1').lower() not in ('0', 'false', 'no')
+# Gather each attention block's relative position bias once at load instead of on every forward
+CACHE_ATTENTION_BIAS = os.environ.get('CACHE_ATTENTION_BIAS', '1').lower() not in ('0', 'false', 'no')
+# Compute MHSA attention with F.scaled_dot_product_attention; validate with check_parity.py first
+ATTENTION_SDPA = os.environ.get('ATTENTION_SDPA', '').lower() in ('1', 'true', 'yes')
+# Confidence at which an image is classified from the stage_3 class token and skips stage_4
+# (unset = off); pick it with calibrate_early_exit.py
+EARLY_EXIT_THRESHOLD = float(os.environ['EARLY_EXIT_THRESHOLD']) if os.environ.get('EARLY_EXIT_THRESHOLD') else None
+# Label index from build_label_index.py (file name under naturalia/, unset = every class): the
+# head only scores our taxonomy's classes and predictions carry our taxon ids
+LABEL_INDEX = os.environ.get('LABEL_INDEX') or None
+# Input resolutions to serve, e.g. "384,224": the first is the default tier, the others are loaded
+# alongside it (bias tables interpolated) and picked per request via `resolution`
+RESOLUTION_TIERS = [int(v) for v in os.environ.get('RESOLUTION_TIERS', '').split(',') if v.strip()]
+# With tiers, requests that don't ask for a resolution go to the smallest tier while at least
+# this many requests are queued for the default one (0 disables)
+RESOLUTION_PRESSURE_DEPTH = int(os.environ.get('RESOLUTION_PRESSURE_DEPTH', '0'))
+# Tier key used throughout: an image size, or None for the config's own DATA.IMG_SIZE
+DEFAULT_TIER = RESOLUTION_TIERS[0] if RESOLUTION_TIERS else None
+# Serve a frozen TorchScript export traced at IMG_SIZE (built and cached on first load, see export_torchscript.py)
+TORCHSCRIPT = os.environ.get('TORCHSCRIPT', '').lower() in ('1', 'true', 'yes')
+# Micro-batching: concurrent requests are grouped into one forward pass of up to
+# BATCH_MAX_SIZE images, waiting at most BATCH_MAX_WAIT_MS for the batch to fill
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', '16'))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', '10'))
+# Admission control: at most INFERENCE_CONCURRENCY forward passes run at once (each already uses
+# every intra-op thread), and at most INFERENCE_QUEUE_MAX images wait per tier (0 = unbounded);
+# past that, requests get a 503 with Retry-After instead of queueing
+INFERENCE_CONCURRENCY = max(1, int(os.environ.get('INFERENCE_CONCURRENCY', '1')))
+INFERENCE_QUEUE_MAX = int(os.environ.get('INFERENCE_QUEUE_MAX', '64'))
+# Intra-op threads per forward pass (0 = the CPU budget split between INFERENCE_CONCURRENCY passes;
+# the budget is the affinity mask capped by the cgroup CPU quota, per worker under serve.py)
+TORCH_NUM_THREADS = int(os.environ.get('TORCH_NUM_THREADS', '0'))
+# The model runs no parallel inter-op work, so one inter-op thread avoids an idle pool per process
+TORCH_INTEROP_THREADS = int(os.environ.get('TORCH_INTEROP_THREADS', '1'))
+# Image fetching: imageUrl bodies are streamed through a shared connection pool and
+# capped at IMAGE_MAX_BYTES; decoding runs in its own pool of DECODE_WORKERS threads
+IMAGE_MAX_BYTES = int(os.environ.get('IMAGE_MAX_BYTES', str(20 * 1024 * 1024)))
+FETCH_TIMEOUT_S = float(os.environ.get('FETCH_TIMEOUT_S', '20'))
+FETCH_MAX_CONNECTIONS = int(os.environ.get('FETCH_MAX_CONNECTIONS', '64'))
+FETCH_MAX_CONNECTIONS_PER_HOST = int(os.environ.get('FETCH_MAX_CONNECTIONS_PER_HOST', '8'))
+# Most images accepted by one /predict/batch request
+BATCH_REQUEST_MAX_IMAGES = int(os.environ.get('BATCH_REQUEST_MAX_IMAGES', '64'))
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', str(min(4, available_cpus()))))
+# Decode large JPEGs at the smallest 1/2, 1/4 or 1/8 DCT scale that still covers the model input
+JPEG_DRAFT_DECODE = os.environ.get('JPEG_DRAFT_DECODE', '1').lower() not in ('0', 'false', 'no')
+# Eager mode: load the model in the background at startup and run WARMUP_ITERATIONS
+# forward passes before /ready reports the instance as routable
+EAGER_MODEL_LOAD = os.environ.get('EAGER_MODEL_LOAD', '').lower() in ('1', 'true', 'yes')
+WARMUP_ITERATIONS = int(os.environ.get('WARMUP_ITERATIONS', '2'))
+# Most predictions one request may ask for with top_k (at least 1)
+TOP_K_MAX = int(os.environ.get('TOP_K_MAX', '100'))
+# Prediction cache keyed by image content + model + top_k. PREDICTION_CACHE_SIZE=0 disables it;
+# PREDICTION_CACHE_DB adds an SQLite tier that survives restarts and is shared between workers
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', '2048'))
+PREDICTION_CACHE_TTL_S = float(os.environ.get('PREDICTION_CACHE_TTL_S', '86400'))
+PREDICTION_CACHE_DB = os.environ.get('PREDICTION_CACHE_DB')
+PREDICTION_CACHE_DB_MAX_ENTRIES = int(os.environ.get('PREDICTION_CACHE_DB_MAX_ENTRIES', '100000'))
 
-# Lazy-loaded inference model (load on first request to avoid OOM on startup)
-inference_model: Optional[Inference] = None
+# Thread pool sizes in effect, set by configure_threads
+thread_config = {}
+
+def configure_threads(cpu_budget=None):
+    """Size the inference thread pools for `cpu_budget` CPUs (default: all this process may use).
+
+    The budget is split between the forward passes that can run at once: the inference pool has
+    INFERENCE_CONCURRENCY threads and every tier's batcher keeps that many batches going, so
+    that many passes do run together under load and their OpenMP teams together fill the
+    budget without oversubscribing it. serve.py calls it again in each worker.
+    """
+    cpu_budget = cpu_budget or available_cpus()
+    # More passes than CPUs would still each need a thread
+    concurrent_passes = min(INFERENCE_CONCURRENCY, cpu_budget)
+    intra_op = TORCH_NUM_THREADS or max(1, cpu_budget // concurrent_passes)
+    inter_op = TORCH_INTEROP_THREADS
+    if INFERENCE_BACKEND == 'torch':
+        intra_op, inter_op = configure_torch_threads(intra_op, TORCH_INTEROP_THREADS)
+    elif ONNX_INTRA_OP_THREADS:
+        intra_op = ONNX_INTRA_OP_THREADS
+    thread_config.update(cpu_budget=cpu_budget, concurrent_passes=concurrent_passes, intra_op_threads=intra_op,
+                         inter_op_threads=inter_op)
+    log.info('Inference threads: %d intra-op x %d concurrent (CPU budget %d)', intra_op, concurrent_passes,
+             cpu_budget)
+
+configure_threads()
+
+# Lazy-loaded inference model (load on first request to avoid OOM on startup);
+# an Inference, or an OnnxInference with INFERENCE_BACKEND=onnx
+inference_model = None
+# Every loaded resolution tier, keyed like DEFAULT_TIER; tier_models[DEFAULT_TIER] is inference_model
+tier_models = {}
 model_init_lock = asyncio.Lock()
+# Load progress reported by /ready: idle -> downloading -> loading -> warming -> ready (or failed)
+load_status = {'state': 'idle', 'detail': None, 'warmup_done': 0, 'warmup_total': 0,
+               'started_at': None, 'load_seconds': None}
+eager_load_task: Optional[asyncio.Task] = None
 
 class PredictRequest(BaseModel):
     imageUrl: Optional[str] = None
     imageBase64: Optional[str] = None
-    top_k: Optional[int] = 10
+    top_k: Optional[int] = Field(10, ge=1, le=TOP_K_MAX)
+    # One of RESOLUTION_TIERS; omitted = default tier (or the low tier under queue pressure)
+    resolution: Optional[int] = None
+
+class BatchImage(BaseModel):
+    # Echoed back on the image's result line
+    id: Optional[str] = None
+    imageUrl: Optional[str] = None
+    imageBase64: Optional[str] = None
+
+class PredictBatchRequest(BaseModel):
+    images: List[BatchImage]
+    top_k: Optional[int] = Field(10, ge=1, le=TOP_K_MAX)
+    resolution: Optional[int] = None
 
 # --- HEALTH CHECK ENDPOINTS ---
 @app.get("/")
 async def root():
     """Root endpoint for Render health probes."""
-    return {"status": "ok", "service": "iNat Vision Service", "endpoints": ["/health", "/predict"]}
+    return {"status": "ok", "service": "iNat Vision Service", "endpoints": ["/health", "/ready", "/predict", "/predict/batch", "/metrics", "/stats", "/model/stats", "/cache/stats"]}
 
 @app.get("/health")
 async def health_check():
     """Simple health endpoint used by load balancers and Render to verify service is up."""
     return {"status": "ok"}
 
-async def ensure_model_loaded():
-    """Lazy-load the model on first request to avoid OOM during startup."""
-    global inference_model
+def mock_mode_enabled():
+    return os.environ.get('MOCK_MODE', '').lower() in ('1', 'true', 'yes')
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 200 once the instance can serve /predict without a cold start.
+
+    With EAGER_MODEL_LOAD the instance is only ready after the model is loaded and warmed up;
+    in lazy mode it is always routable (the first request triggers the load).
+    """
+    status = dict(load_status)
+    if status['started_at'] is not None and status['load_seconds'] is None:
+        status['elapsed_seconds'] = round(time.monotonic() - status.pop('started_at'), 1)
+    else:
+        status.pop('started_at')
+    ready = inference_model is not None or mock_mode_enabled() or not EAGER_MODEL_LOAD
+    return JSONResponse(status_code=200 if ready else 503, content={'ready': ready, **status})
+
+def _set_load_state(state, detail=None):
+    load_status['state'] = state
+    load_status['detail'] = detail
+
+def fetch_model_files():
+    """Download any missing model files into the vendored folder; returns (model, cfg, names) paths."""
+    token = HUGGINGFACE_TOKEN
+    if not token:
+        log.warning('HUGGINGFACE_TOKEN not set; hf_hub_download may fail for private models')
+
+    # Ensure the vendored directory exists and download missing files if needed
+    NATURALIA_DIR.mkdir(parents=True, exist_ok=True)
+    import shutil
+
+    def _fetch_to_vendor(filename):
+        dest = NATURALIA_DIR / filename
+        if dest.exists():
+            return str(dest)
+        if hf_hub_download is None:
+            raise RuntimeError('huggingface_hub not available to download files')
+        log.info(f'Downloading {filename}...')
+        downloaded = hf_hub_download(repo_id=HF_REPO, filename=filename, token=token)
+        shutil.copy(downloaded, dest)
+        log.info(f'Downloaded {filename} to {dest}')
+        return str(dest)
+
+    cfg_path = _fetch_to_vendor(CFG_FILE)
+    names_path = _fetch_to_vendor(NAMES_FILE)
+    if INFERENCE_BACKEND == 'onnx':
+        # Exported locally from the PyTorch weights; not published on the Hub
+        model_path = NATURALIA_DIR / ONNX_MODEL_FILE
+        if not model_path.exists():
+            raise FileNotFoundError(f'{model_path} not found; create it with `python export_onnx.py`')
+        log.info(f'ONNX model: {model_path}, names: {names_path}')
+        return str(model_path), cfg_path, names_path
+
+    model_path = _fetch_to_vendor(MODEL_FILE)
+    if CONVERT_WEIGHTS:
+        converted = inference_weights_path(model_path)
+        if not converted.exists():
+            log.info(f'Converting {model_path} to inference-only weights at {converted}...')
+            convert_checkpoint(model_path, converted)
+        model_path = str(converted)
+
+    log.info(f'Model path: {model_path}, cfg: {cfg_path}, names: {names_path}')
+    return model_path, cfg_path, names_path
+
+def label_index_path():
+    if LABEL_INDEX is None:
+        return None
+    path = NATURALIA_DIR / LABEL_INDEX
+    if not path.exists():
+        raise FileNotFoundError(f'{path} not found; create it with `python build_label_index.py`')
+    return str(path)
+
+def create_inference(model_path, cfg_path, names_path, img_size=None):
+    if INFERENCE_BACKEND == 'onnx':
+        if img_size is not None:
+            raise RuntimeError('RESOLUTION_TIERS needs INFERENCE_BACKEND=torch; ONNX graphs have a fixed input size')
+        return OnnxInference(model_path, names_path, intra_op_threads=thread_config['intra_op_threads'],
+                             inter_op_threads=ONNX_INTER_OP_THREADS, label_index=label_index_path())
+    # Initialize the Inference class (this can be slow ~30-60s)
+    return Inference(config_path=cfg_path, model_path=model_path, names_path=names_path,
+                     quantize=QUANTIZE_INT8, torchscript=TORCHSCRIPT, cache_bias=CACHE_ATTENTION_BIAS,
+                     sdpa=ATTENTION_SDPA, fuse=FUSE_CONV_BN, img_size=img_size,
+                     early_exit_threshold=EARLY_EXIT_THRESHOLD, label_index=label_index_path(),
+                     draft_decode=JPEG_DRAFT_DECODE)
+
+def create_tier_models(paths):
+    """Build one model per resolution tier; {DEFAULT_TIER: model} without RESOLUTION_TIERS.
+
+    With mmap-able weights the tiers share the same file-backed weight pages; only the
+    interpolated bias tables and fused/quantized layers are per tier.
+    """
+    models = {}
+    for tier in RESOLUTION_TIERS or [None]:
+        if tier in models:
+            continue
+        log.info('Loading model at %s', f'{tier}px' if tier else 'the config IMG_SIZE')
+        models[tier] = create_inference(*paths, img_size=tier)
+    return models
+
+def _start_load():
+    log.info('Loading model...')
+    load_status['started_at'] = time.monotonic()
+    load_status['load_seconds'] = None
+    _set_load_state('downloading')
+
+def _finish_load():
+    elapsed = time.monotonic() - load_status['started_at']
+    load_status['load_seconds'] = round(elapsed, 1)
+    metrics.MODEL_LOAD_SECONDS.set(elapsed)
+    _set_load_state('ready')
+    log.info('Inference model loaded and ready in %ss', load_status['load_seconds'])
+
+async def ensure_model_loaded(warmup_iterations=0):
+    """Lazy-load the model on first request to avoid OOM during startup.
+
+    `warmup_iterations` forward passes run before the model is published, so requests
+    that arrive meanwhile wait on the lock and then hit an already-warm model.
+    """
+    global inference_model, tier_models
     
     if inference_model is not None:
         return
@@ -68,137 +317,516 @@ async def ensure_model_loaded():
             return
         
         try:
-            log.info('Lazy-loading model on first request...')
-            token = HUGGINGFACE_TOKEN
-            if not token:
-                log.warning('HUGGINGFACE_TOKEN not set; hf_hub_download may fail for private models')
-
-            # Ensure the vendored directory exists and download missing files if needed
-            NATURALIA_DIR.mkdir(parents=True, exist_ok=True)
-            import shutil
-
-            def _fetch_to_vendor(filename):
-                dest = NATURALIA_DIR / filename
-                if dest.exists():
-                    return str(dest)
-                if hf_hub_download is None:
-                    raise RuntimeError('huggingface_hub not available to download files')
-                log.info(f'Downloading {filename}...')
-                downloaded = hf_hub_download(repo_id=HF_REPO, filename=filename, token=token)
-                shutil.copy(downloaded, dest)
-                log.info(f'Downloaded {filename} to {dest}')
-                return str(dest)
-
-            model_path = _fetch_to_vendor(MODEL_FILE)
-            cfg_path = _fetch_to_vendor(CFG_FILE)
-            names_path = _fetch_to_vendor(NAMES_FILE)
-
-            log.info(f'Model path: {model_path}, cfg: {cfg_path}, names: {names_path}')
-
-            # Initialize the Inference class (this can be slow ~30-60s)
+            _start_load()
             loop = asyncio.get_event_loop()
-            def init():
-                return Inference(config_path=cfg_path, model_path=model_path, names_path=names_path)
-            inference_model = await loop.run_in_executor(None, init)
-            log.info('Inference model loaded and ready')
+            paths = await loop.run_in_executor(None, fetch_model_files)
+
+            _set_load_state('loading')
+            models = await loop.run_in_executor(None, create_tier_models, paths)
+
+            load_status['warmup_total'] = warmup_iterations * len(models)
+            load_status['warmup_done'] = 0
+            if warmup_iterations > 0:
+                sizes = ', '.join(f'{m.img_size}px' for m in models.values())
+                _set_load_state('warming', f'{warmup_iterations} forward passes at {sizes}')
+                for model in models.values():
+                    for _ in range(warmup_iterations):
+                        await loop.run_in_executor(inference_executor, model.warmup)
+                        load_status['warmup_done'] += 1
+
+            tier_models = models
+            inference_model = models[DEFAULT_TIER]
+            _finish_load()
         except Exception as e:
             log.exception('Failed to initialize model: %s', e)
             inference_model = None
+            _set_load_state('failed', str(e))
             raise
 
-@app.post('/predict')
-async def predict(req: PredictRequest):
-    # Check MOCK_MODE first to skip expensive model loading
-    mock_mode = os.environ.get('MOCK_MODE', '').lower() in ('1', 'true', 'yes')
-    
-    if mock_mode:
-        # Return mock predictions without loading the model
-        sample_labels = []
+def preload_model(share_memory=True):
+    """Load the model synchronously before any event loop runs (multi-process mode, see serve.py).
+
+    Memory-mapped weights are shared through the page cache as they are; otherwise, with
+    `share_memory`, they are moved into shared memory so forked workers all read the same
+    pages instead of relying on copy-on-write alone. Frozen TorchScript modules can't be
+    shared this way and stay copy-on-write.
+    """
+    global inference_model, tier_models
+    _start_load()
+    paths = fetch_model_files()
+    _set_load_state('loading')
+    models = create_tier_models(paths)
+    for model in models.values():
+        if model.weights_mmapped:
+            # File-backed pages are already shared between forked workers through the page cache
+            log.info('Model weights are memory-mapped from %s', paths[0])
+        elif share_memory and INFERENCE_BACKEND == 'torch' and model.torchscript_path is not None:
+            # A frozen TorchScript module folds its weights into graph constants that
+            # share_memory() does not reach, so workers would copy them on write anyway
+            log.warning('Shared weights are unavailable for TORCHSCRIPT models, relying on copy-on-write')
+        elif share_memory and INFERENCE_BACKEND == 'torch':
+            try:
+                share_model_memory(model.model)
+                log.info('Model weights moved to shared memory')
+            except RuntimeError as e:
+                # Typically a small /dev/shm (Docker defaults to 64MB); fork still shares pages copy-on-write
+                log.warning('Could not move weights to shared memory, relying on copy-on-write: %s', e)
+    tier_models = models
+    inference_model = models[DEFAULT_TIER]
+    _finish_load()
+
+def warm_up_model(iterations):
+    """Run warm-up passes on an already loaded model (blocking), tracking progress for /ready."""
+    load_status['warmup_total'] = iterations * len(tier_models)
+    load_status['warmup_done'] = 0
+    for model in tier_models.values():
+        for _ in range(iterations):
+            model.warmup()
+            load_status['warmup_done'] += 1
+
+@app.on_event('startup')
+async def start_eager_load():
+    """With EAGER_MODEL_LOAD, load and warm the model in the background instead of on the first request."""
+    global eager_load_task
+    if not EAGER_MODEL_LOAD or mock_mode_enabled():
+        return
+
+    async def load():
         try:
-            with open(NATURALIA_DIR / 'names_mf2.txt', 'r', encoding='utf-8') as f:
-                sample_labels = [l.strip() for l in f.readlines() if l.strip()]
+            await ensure_model_loaded(warmup_iterations=WARMUP_ITERATIONS)
         except Exception:
-            sample_labels = ['Danaus plexippus', 'Papilio machaon', 'Pieris rapae', 'Vanessa atalanta', 'Morpho peleides']
+            # Already logged and recorded in load_status; /predict retries the load lazily
+            pass
+    eager_load_task = asyncio.get_event_loop().create_task(load())
 
-        k = req.top_k or 5
-        out = []
-        for i, lab in enumerate(sample_labels[:k]):
-            out.append({'label': lab, 'score': float(1.0 / (i + 1))})
-        return {'success': True, 'data': out}
-    
-    # Otherwise, lazy-load the real model on first request
-    await ensure_model_loaded()
-    
+def tier_label(tier):
+    """Name of a tier in /stats and metric labels."""
+    return str(tier or 'default')
+
+def run_batch(tier, items):
+    """Run one batched forward pass of the `tier` model for a list of (decoded image, top_k, queued at) items.
+
+    Returns one compact `TopK` (label indices, float32 scores) per item.
+    """
+    started = time.monotonic()
+    for _, _, queued_at in items:
+        # Batching window plus any wait for a free inference thread
+        metrics.STAGE_SECONDS.labels('queue_wait').observe(started - queued_at)
+    metrics.BATCH_SIZE.labels(tier_label(tier)).observe(len(items))
+    metrics.QUEUE_DEPTH.labels(tier_label(tier)).set(batchers[tier].pending())
+
+    ks = [k for _, k, _ in items]
+    max_k = None if None in ks else max(ks)
+    timings = {}
+    results = tier_models[tier].infer_batch([img for img, _, _ in items], topk=max_k,
+                                            meta_data_path=str(NATURALIA_DIR / 'meta.txt'), compact=True,
+                                            timings=timings)
+    metrics.observe_stages(timings)
+    # A single topk over the batch at the largest k, sliced per caller afterwards
+    return [TopK(res.indices[:k], res.scores[:k]) for res, k in zip(results, ks)]
+
+# Forward passes of every tier share this pool instead of the event loop's default executor
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_CONCURRENCY, thread_name_prefix='inference')
+# One queue per tier: a batch is a single forward pass, so it can only hold one input size
+batchers = {tier: MicroBatcher(partial(run_batch, tier), max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                               executor=inference_executor, max_queue=INFERENCE_QUEUE_MAX or None,
+                               max_concurrency=INFERENCE_CONCURRENCY)
+            for tier in RESOLUTION_TIERS or [None]}
+
+def overloaded(tier):
+    """503 for a request that found the tier's queue full, with a drain-time Retry-After."""
+    metrics.REJECTED.labels(tier_label(tier)).inc()
+    return HTTPException(status_code=503, detail='Inference queue is full, retry later',
+                         headers={'Retry-After': str(batchers[tier].retry_after())})
+
+def choose_tier(requested):
+    """Tier for a request: the one it asked for, else the default unless its queue is backed up."""
+    if requested is not None:
+        if requested not in batchers:
+            allowed = ', '.join(str(t) for t in RESOLUTION_TIERS) or 'none configured'
+            raise HTTPException(status_code=400, detail=f'resolution must be one of: {allowed}')
+        return requested
+    if RESOLUTION_PRESSURE_DEPTH > 0 and len(RESOLUTION_TIERS) > 1 and \
+            batchers[DEFAULT_TIER].pending() >= RESOLUTION_PRESSURE_DEPTH:
+        return min(RESOLUTION_TIERS)
+    return DEFAULT_TIER
+
+fetcher = ImageFetcher(max_bytes=IMAGE_MAX_BYTES, timeout=FETCH_TIMEOUT_S,
+                       max_connections=FETCH_MAX_CONNECTIONS,
+                       max_connections_per_host=FETCH_MAX_CONNECTIONS_PER_HOST)
+decode_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='decode')
+prediction_cache = PredictionCache(max_entries=PREDICTION_CACHE_SIZE, ttl_seconds=PREDICTION_CACHE_TTL_S,
+                                   db_path=PREDICTION_CACHE_DB,
+                                   max_db_entries=PREDICTION_CACHE_DB_MAX_ENTRIES) if PREDICTION_CACHE_SIZE > 0 else None
+
+def file_version(filename):
+    """`<mtime_ns>:<size>` of a file under naturalia/, so replacing it under the same name changes cache keys."""
+    path = NATURALIA_DIR / filename
+    if not path.exists():
+        return '0'
+    st = path.stat()
+    return f'{st.st_mtime_ns}:{st.st_size}'
+
+def model_cache_id():
+    """Identity of the model producing predictions; part of every cache key."""
+    model_id = '|'.join(f'{name}@{file_version(name)}' for name in (MODEL_FILE, CFG_FILE, NAMES_FILE))
+    if INFERENCE_BACKEND == 'onnx':
+        model_id += f'|onnx:{ONNX_MODEL_FILE}@{file_version(ONNX_MODEL_FILE)}'
+    else:
+        # Each changes logits at float tolerance or more; CACHE_ATTENTION_BIAS and CONVERT_WEIGHTS
+        # reproduce them exactly and are left out
+        if TORCHSCRIPT:
+            model_id += '|torchscript'
+        if ATTENTION_SDPA:
+            model_id += '|sdpa'
+        if not FUSE_CONV_BN:
+            model_id += '|unfused'
+    if JPEG_DRAFT_DECODE:
+        # Decoded pixels depend on the draft size: the largest tier, else the config's IMG_SIZE
+        model_id += f'|draft@{max(RESOLUTION_TIERS) if RESOLUTION_TIERS else "cfg"}'
+    if QUANTIZE_INT8:
+        model_id += '|int8'
+    if EARLY_EXIT_THRESHOLD is not None:
+        model_id += f'|exit@{EARLY_EXIT_THRESHOLD}'
+    if LABEL_INDEX is not None:
+        # Rebuilding the index changes labels and taxon ids
+        model_id += f'|labels:{LABEL_INDEX}@{file_version(LABEL_INDEX)}'
+    return model_id
+
+def decode_min_size():
+    """Size a JPEG may be draft-decoded down to: the largest tier's input, so every tier can use it."""
+    if not JPEG_DRAFT_DECODE or not tier_models:
+        return None
+    return max(model.img_size for model in tier_models.values())
+
+def tier_cache_key(image_key, tier):
+    """Cache key of the prediction for an image (`PredictionCache.make_key`) at a resolution tier."""
+    return image_key if tier is None else f'{image_key}@{tier}'
+
+@app.get('/cache/stats')
+async def cache_stats():
+    if prediction_cache is None:
+        return {'enabled': False}
+    return {'enabled': True, **prediction_cache.stats()}
+
+@app.get('/stats')
+async def stats():
+    """Inference admission state: per-tier queue depth, rejections, queue-wait and batch times."""
+    return {
+        'inference_concurrency': INFERENCE_CONCURRENCY,
+        'threads': thread_config,
+        'batch_max_size': BATCH_MAX_SIZE,
+        'tiers': {tier_label(tier): tier_batcher.stats() for tier, tier_batcher in batchers.items()},
+    }
+
+@app.get('/metrics')
+async def prometheus_metrics():
+    """Prometheus text exposition: per-stage latency histograms, batch sizes, cache, load time, RSS."""
+    for tier, tier_batcher in batchers.items():
+        metrics.QUEUE_DEPTH.labels(tier_label(tier)).set(tier_batcher.pending())
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get('/model/stats')
+async def model_stats():
+    """Per-tier input size and early-exit counters of the loaded model(s)."""
     if inference_model is None:
-        raise HTTPException(status_code=503, detail='Model not initialized')
+        return {'loaded': False}
+    tiers = []
+    for model in tier_models.values():
+        entry = {'img_size': model.img_size}
+        if hasattr(model, 'early_exit_stats'):
+            entry['early_exit'] = model.early_exit_stats()
+        tiers.append(entry)
+    return {'loaded': True, 'backend': INFERENCE_BACKEND, 'tiers': tiers}
 
-    # Obtain PIL Image
-    if not req.imageUrl and not req.imageBase64:
-        raise HTTPException(status_code=400, detail='imageUrl or imageBase64 required')
+@app.on_event('shutdown')
+async def shutdown_workers():
+    for tier_batcher in batchers.values():
+        await tier_batcher.stop()
+    await fetcher.close()
+    decode_executor.shutdown(wait=False)
+    inference_executor.shutdown(wait=False)
+    if prediction_cache is not None:
+        prediction_cache.close()
 
-    img = None
+def mock_predictions(top_k):
+    sample_labels = []
+    try:
+        with open(NATURALIA_DIR / 'names_mf2.txt', 'r', encoding='utf-8') as f:
+            sample_labels = [l.strip() for l in f.readlines() if l.strip()]
+    except Exception:
+        sample_labels = ['Danaus plexippus', 'Papilio machaon', 'Pieris rapae', 'Vanessa atalanta', 'Morpho peleides']
+
+    k = top_k or 5
+    out = []
+    for i, lab in enumerate(sample_labels[:k]):
+        out.append({'label': lab, 'score': float(1.0 / (i + 1))})
+    return out
+
+async def load_image_bytes(image_url=None, image_b64=None):
+    """Encoded image of an `imageUrl` / `imageBase64` payload (413 past IMAGE_MAX_BYTES, 400 on failure)."""
+    if not image_url and not image_b64:
+        raise HTTPException(status_code=400, detail='imageUrl or imageBase64 required')
+    # Download on the event loop (non-blocking), base64-decode in the worker pool
+    loop = asyncio.get_event_loop()
     try:
-        if req.imageBase64:
-            # Accept data URL or raw base64
-            b = req.imageBase64
-            if b.startswith('data:'):
-                b = b.split(',', 1)[1]
-            img_bytes = base64.b64decode(b)
-            img = Image.open(io.BytesIO(img_bytes)).convert('RGB')
-        else:
-            # requests will be used inside inference if string given, but we want to pass PIL to avoid duplicate downloads
-            from requests import get
-            resp = get(req.imageUrl, stream=True, timeout=20)
-            resp.raise_for_status()
-            img = Image.open(resp.raw).convert('RGB')
+        with metrics.timed('fetch'):
+            if image_b64:
+                return await loop.run_in_executor(decode_executor, decode_base64, image_b64, IMAGE_MAX_BYTES)
+            return await fetcher.fetch(image_url)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         log.exception('Failed to load image: %s', e)
         raise HTTPException(status_code=400, detail=f'Failed to load image: {e}')
 
-    # Run inference in threadpool because PyTorch is blocking
+def format_predictions(raw):
+    """Response items of a compact TopK: label and score, plus our taxa with a LABEL_INDEX."""
+    labels = inference_model.classes
+    data = [{'label': labels[idx], 'score': score} for idx, score in zip(raw.indices.tolist(), raw.scores.tolist())]
+    if inference_model.class_taxa is not None:
+        for item, idx in zip(data, raw.indices.tolist()):
+            taxa = inference_model.class_taxa[idx]
+            item['match'] = taxa.match
+            item['taxonIds'] = taxa.taxon_ids
+    return data
+
+async def classify_image_bytes(img_bytes, top_k, resolution=None):
+    """Predictions for an encoded image: cache lookup, lazy model load, decode, batched forward pass."""
+    # Validates an explicit resolution; otherwise the tier is settled again right before queueing
+    tier = choose_tier(resolution)
     loop = asyncio.get_event_loop()
-    def run_infer():
-        try:
-            # Inference.infer expects img_path or image object and meta_data_path
-            res = inference_model.infer(img_path=img, meta_data_path=str(NATURALIA_DIR / 'meta.txt'), topk=req.top_k)
-            return res
-        except Exception as e:
-            log.exception('Inference failed: %s', e)
-            raise
 
+    image_key = None
+    if prediction_cache is not None:
+        image_key = await loop.run_in_executor(decode_executor, prediction_cache.make_key,
+                                               img_bytes, model_cache_id(), top_k)
+        cache_key = tier_cache_key(image_key, tier)
+        cached = prediction_cache.get_memory(cache_key)
+        if cached is None and prediction_cache.persistent:
+            # SQLite lookups block, so they run off the event loop
+            cached = await loop.run_in_executor(decode_executor, prediction_cache.get_disk, cache_key)
+        metrics.CACHE_REQUESTS.labels('miss' if cached is None else 'hit').inc()
+        if cached is not None:
+            return cached
+
+    # Shed load before spending decode time on an image that can't be queued
     try:
-        raw = await loop.run_in_executor(None, run_infer)
+        batchers[tier].check_admission()
+    except QueueFull:
+        raise overloaded(tier)
+
+    # Otherwise, lazy-load the real model on first request (cache hits above don't need it)
+    await ensure_model_loaded()
+
+    if inference_model is None:
+        raise HTTPException(status_code=503, detail='Model not initialized')
+
+    try:
+        with metrics.timed('decode'):
+            img = await loop.run_in_executor(decode_executor, decode_image, img_bytes, decode_min_size())
+    except Exception as e:
+        log.exception('Failed to decode image: %s', e)
+        raise HTTPException(status_code=400, detail=f'Failed to load image: {e}')
+    del img_bytes
+
+    if resolution is None:
+        # Queue depth as of now, after download and decode
+        tier = choose_tier(None)
+
+    # Queue for the next batched forward pass (runs in the threadpool because PyTorch is blocking)
+    try:
+        raw = await batchers[tier].submit((img, top_k, time.monotonic()))
+    except QueueFull:
+        raise overloaded(tier)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Inference error: {e}')
 
-    # Normalize output: support several shapes (dict, list-of-dict, list of [label,score])
-    normalized = []
+    data = format_predictions(raw)
+    if image_key is not None:
+        await loop.run_in_executor(decode_executor, prediction_cache.put, tier_cache_key(image_key, tier), data)
+    return data
+
+def int_param(value, name, default=None, ge=None, le=None):
+    if value is None or value == '':
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f'{name} must be an integer')
+    if (ge is not None and number < ge) or (le is not None and number > le):
+        raise HTTPException(status_code=422, detail=f'{name} must be between {ge} and {le}')
+    return number
+
+async def parse_json_body(request, model, error):
+    """`model` built from a JSON object body; 422 for bad JSON, a non-object (e.g. a list) or failed validation."""
+    try:
+        payload = await request.json()
+        if not isinstance(payload, dict):
+            raise ValueError(f'expected a JSON object, got {type(payload).__name__}')
+        return model(**payload)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f'{error}: {e}')
+
+def check_content_length(request, limit, detail=None):
+    """413 up front when the declared body size is already over `limit`."""
+    length = request.headers.get('content-length')
+    if length is not None and length.isdigit() and int(length) > limit:
+        raise HTTPException(status_code=413, detail=detail or f'image exceeds {IMAGE_MAX_BYTES} bytes')
+
+async def read_upload_body(request):
+    """Raw image body streamed into one buffer capped at IMAGE_MAX_BYTES."""
+    check_content_length(request, IMAGE_MAX_BYTES)
     try:
-        if isinstance(raw, dict):
-            # raw mapping label->score (ordered descending)
-            for label, score in raw.items():
-                normalized.append({'label': label, 'score': float(score)})
-        elif isinstance(raw, list):
-            # Sometimes returns [{label:score, ...}]
-            first = raw[0] if len(raw) > 0 else None
-            if isinstance(first, dict):
-                # convert dict to list by items
-                for label, score in first.items():
-                    normalized.append({'label': label, 'score': float(score)})
-            elif isinstance(first, list) and len(first) > 0 and isinstance(first[0], (list, tuple)):
-                # list of [label,score]
-                for item in first:
-                    normalized.append({'label': str(item[0]), 'score': float(item[1])})
+        with metrics.timed('fetch'):
+            return await read_stream(request.stream(), IMAGE_MAX_BYTES)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+async def read_multipart_image(request):
+    """(image bytes or None, text fields) of a multipart body, parsed as it streams in."""
+    # Boundaries and part headers add a little on top of the image itself
+    check_content_length(request, IMAGE_MAX_BYTES + 64 * 1024)
+    try:
+        reader = MultipartImage(request.headers['content-type'], IMAGE_MAX_BYTES)
+        with metrics.timed('fetch'):
+            async for chunk in request.stream():
+                reader.write(chunk)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f'Invalid multipart body: {e}')
+    return reader.image, reader.fields
+
+@app.post('/predict')
+async def predict(request: Request):
+    """Classify one image.
+
+    Body: JSON `PredictRequest` (`imageUrl` or `imageBase64`); a raw image (`Content-Type: image/*`
+    or `application/octet-stream`, with `top_k` / `resolution` query parameters); or
+    multipart/form-data with one image file part and optional `top_k` / `resolution` fields.
+    The binary forms skip base64's 33% inflation and the JSON string copy.
+    """
+    with metrics.REQUEST_SECONDS.labels('predict').time():
+        return await predict_one(request)
+
+async def predict_one(request):
+    """Body of `predict`, which times it."""
+    media_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    raw_body = media_type.startswith('image/') or media_type == 'application/octet-stream'
+    req, img_bytes = None, None
+    if raw_body:
+        top_k = int_param(request.query_params.get('top_k'), 'top_k', 10, ge=1, le=TOP_K_MAX)
+        resolution = int_param(request.query_params.get('resolution'), 'resolution')
+    elif media_type == 'multipart/form-data':
+        img_bytes, fields = await read_multipart_image(request)
+        top_k = int_param(fields.get('top_k'), 'top_k', 10, ge=1, le=TOP_K_MAX)
+        resolution = int_param(fields.get('resolution'), 'resolution')
+    else:
+        req = await parse_json_body(request, PredictRequest, 'Invalid request')
+        top_k, resolution = req.top_k, req.resolution
+
+    # Check MOCK_MODE first to skip expensive model loading
+    if mock_mode_enabled():
+        # Return mock predictions without loading the model
+        return {'success': True, 'data': mock_predictions(top_k)}
+
+    # Reject a bad resolution before reading or downloading the image
+    choose_tier(resolution)
+    if raw_body:
+        img_bytes = await read_upload_body(request)
+    elif req is not None:
+        img_bytes = await load_image_bytes(req.imageUrl, req.imageBase64)
+    elif img_bytes is None:
+        raise HTTPException(status_code=400, detail='multipart body has no image file part')
+    data = await classify_image_bytes(img_bytes, top_k, resolution)
+    return {'success': True, 'data': data}
+
+async def read_multipart_batch(request):
+    """(`(filename, bytes or None past IMAGE_MAX_BYTES)` per file part, text fields), parsed as the body streams in.
+
+    Counted as it arrives, so a chunked body without Content-Length is bounded too.
+    """
+    limit = BATCH_REQUEST_MAX_IMAGES * (IMAGE_MAX_BYTES + 64 * 1024)
+    check_content_length(request, limit, f'at most {BATCH_REQUEST_MAX_IMAGES} images of {IMAGE_MAX_BYTES} bytes '
+                                         'per request')
+    try:
+        reader = MultipartImage(request.headers['content-type'], IMAGE_MAX_BYTES,
+                                max_images=BATCH_REQUEST_MAX_IMAGES, skip_oversized=True, max_total_bytes=limit)
+        with metrics.timed('fetch'):
+            async for chunk in request.stream():
+                reader.write(chunk)
+    except (TooManyImages, ImageTooLarge) as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f'Invalid multipart body: {e}')
+    return reader.files, reader.fields
+
+async def uploaded_bytes(payload):
+    """A multipart part read up front: its bytes, or the HTTPException it failed with."""
+    if isinstance(payload, HTTPException):
+        raise payload
+    return payload
+
+async def stream_batch_predictions(sources, top_k, resolution):
+    """One NDJSON line per `(id, load)` source, in completion order.
+
+    All images are loaded concurrently (downloads share the fetcher's connection limits) and
+    meet in the tier batchers, so they are classified in as few forward passes as possible.
+    """
+    async def run(index, item_id, load):
+        line = {'index': index, 'id': item_id}
+        try:
+            if mock_mode_enabled():
+                data = mock_predictions(top_k)
             else:
-                # unknown list shape, attempt to coerce
-                for item in raw:
-                    if isinstance(item, dict) and 'label' in item:
-                        normalized.append({'label': item.get('label'), 'score': float(item.get('score', 0))})
-        else:
-            # fallback
-            normalized = [{'label': str(raw), 'score': 0}]
-    except Exception as e:
-        log.exception('Failed to normalize inference output: %s', e)
-        normalized = [{'label': str(raw), 'score': 0}]
+                data = await classify_image_bytes(await load(), top_k, resolution)
+            line.update(success=True, data=data)
+        except HTTPException as e:
+            line.update(success=False, status=e.status_code, error=e.detail)
+            if e.headers and 'Retry-After' in e.headers:
+                line['retryAfter'] = int(e.headers['Retry-After'])
+        except Exception as e:
+            log.exception('Batch item %d failed: %s', index, e)
+            line.update(success=False, status=500, error=str(e))
+        return line
+
+    started = time.perf_counter()
+    tasks = [asyncio.ensure_future(run(index, item_id, load)) for index, (item_id, load) in enumerate(sources)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield json.dumps(await next_done) + '\n'
+        metrics.REQUEST_SECONDS.labels('predict_batch').observe(time.perf_counter() - started)
+    finally:
+        # Client went away: stop downloads and queued work for the remaining images
+        for task in tasks:
+            task.cancel()
+
+@app.post('/predict/batch')
+async def predict_batch(request: Request):
+    """Classify up to BATCH_REQUEST_MAX_IMAGES images in one request, streaming NDJSON results.
+
+    Body: JSON `{"images": [{"id", "imageUrl" | "imageBase64"}, ...], "top_k", "resolution"}`,
+    or multipart/form-data with image files plus optional `top_k` / `resolution` fields.
+    Each line is `{"index", "id", "success": true, "data"}` or `{"index", "id", "success": false,
+    "status", "error"}`; `index` is the image's position in the request.
+    """
+    if request.headers.get('content-type', '').startswith('multipart/form-data'):
+        files, fields = await read_multipart_batch(request)
+        top_k = int_param(fields.get('top_k'), 'top_k', 10, ge=1, le=TOP_K_MAX)
+        resolution = int_param(fields.get('resolution'), 'resolution')
+        too_large = HTTPException(status_code=413, detail=f'image exceeds {IMAGE_MAX_BYTES} bytes')
+        payloads = [(filename, too_large if data is None else data) for filename, data in files]
+        sources = [(item_id, partial(uploaded_bytes, payload)) for item_id, payload in payloads]
+    else:
+        body = await parse_json_body(request, PredictBatchRequest, 'Invalid batch request')
+        if len(body.images) > BATCH_REQUEST_MAX_IMAGES:
+            raise HTTPException(status_code=413, detail=f'at most {BATCH_REQUEST_MAX_IMAGES} images per request')
+        top_k, resolution = body.top_k, body.resolution
+        sources = [(img.id, partial(load_image_bytes, img.imageUrl, img.imageBase64)) for img in body.images]
 
-    return { 'success': True, 'data': normalized }
\ No newline at end of file
+    if not sources:
+        raise HTTPException(status_code=400, detail='no images in request')
+    choose_tier(resolution)
+    return StreamingResponse(stream_batch_predictions(sources, top_k, resolution), media_type='application/x-ndjson')
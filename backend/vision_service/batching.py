@@ -0,0 +1,206 @@
+"""
+Dynamic micro-batching for the vision service.
+
+Concurrent `/predict` calls are queued and gathered into a single batch, either
+when `max_batch_size` items are waiting or `max_wait_ms` after the first item
+arrived, whichever comes first. The batch is handed to `batch_fn` in one call
+(running in an executor because PyTorch is blocking) and each caller receives
+its own entry of the returned list.
+
+Up to `max_concurrency` batches run at once; the next batch is only collected once one of
+them finishes, so items arriving meanwhile keep joining it.
+
+With `max_queue` the wait queue is bounded: `submit` raises `QueueFull` instead of
+letting a burst pile up, and `retry_after()` estimates when there will be room.
+`stats()` reports queue depth and recent queue-wait and batch times.
+"""
+import asyncio
+import logging
+import math
+from collections import deque
+from typing import Any, Callable, List, Optional
+
+# Queue waits and batch durations kept for the percentiles in stats()
+STATS_WINDOW = 1024
+
+log = logging.getLogger("inat-vision-service.batching")
+
+
+class QueueFull(RuntimeError):
+    """Raised by `MicroBatcher.submit` when `max_queue` items are already waiting."""
+
+
+def _percentiles(values):
+    if not values:
+        return {'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+    ordered = sorted(values)
+
+    def ms(q):
+        return round(1000 * ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+    return {'mean': round(1000 * sum(ordered) / len(ordered), 2), 'p50': ms(0.5), 'p95': ms(0.95), 'max': ms(1.0)}
+
+
+class MicroBatcher:
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 16,
+                 max_wait_ms: float = 10.0, executor=None, max_queue: Optional[int] = None,
+                 max_concurrency: int = 1):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be >= 1')
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.executor = executor
+        self.max_queue = max_queue
+        self.max_concurrency = max(1, max_concurrency)
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._running = set()
+        self.in_flight = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.batches = 0
+        self.batched_items = 0
+        self._waits = deque(maxlen=STATS_WINDOW)
+        self._batch_seconds = deque(maxlen=STATS_WINDOW)
+
+    def start(self):
+        """Create the queue and the consumer task on the running event loop."""
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._worker = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        running = list(self._running)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        # Fail anything still waiting so callers don't hang on shutdown
+        while not self._queue.empty():
+            _, fut, _ = self._queue.get_nowait()
+            if not fut.done():
+                fut.set_exception(RuntimeError('batcher stopped'))
+        self._worker = None
+        self._queue = None
+        self._slots = None
+
+    def pending(self) -> int:
+        """Items queued and not yet picked up for a batch."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def full(self) -> bool:
+        return self.max_queue is not None and self.pending() >= self.max_queue
+
+    def retry_after(self) -> int:
+        """Whole seconds until the current queue should have drained, from recent batch times."""
+        per_batch = sum(self._batch_seconds) / len(self._batch_seconds) if self._batch_seconds else 1.0
+        batches_ahead = math.ceil(self.pending() / self.max_batch_size) + len(self._running)
+        return max(1, math.ceil(math.ceil(batches_ahead / self.max_concurrency) * per_batch))
+
+    def stats(self) -> dict:
+        """Queue depth, counters and recent queue-wait / batch-duration percentiles (ms)."""
+        return {
+            'queue_depth': self.pending(),
+            'queue_max': self.max_queue,
+            'in_flight': self.in_flight,
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'batches': self.batches,
+            'mean_batch_size': round(self.batched_items / self.batches, 2) if self.batches else 0.0,
+            'queue_wait_ms': _percentiles(self._waits),
+            'batch_ms': _percentiles(self._batch_seconds),
+        }
+
+    def check_admission(self):
+        """Raise QueueFull (and count the rejection) when the queue is at max_queue."""
+        if self.full():
+            self.rejected += 1
+            raise QueueFull(f'{self.pending()} items already queued')
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one item and wait for its result from the next batch; QueueFull when the queue is at max_queue."""
+        if self._worker is None:
+            self.start()
+        self.check_admission()
+        self.submitted += 1
+        loop = asyncio.get_event_loop()
+        fut = loop.create_future()
+        await self._queue.put((item, fut, loop.time()))
+        return await fut
+
+    async def _collect(self):
+        """Wait for the first item, then gather more until the batch is full or the wait expires."""
+        loop = asyncio.get_event_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already queued without paying for a timer
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            # Only start collecting once a batch can run; until then items keep queueing
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            # Callers that gave up (client disconnect, timeout) don't need a slot in the forward pass
+            batch = [(item, fut, queued_at) for item, fut, queued_at in batch if not fut.done()]
+            if not batch:
+                self._slots.release()
+                continue
+            task = loop.create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_event_loop()
+        items = [item for item, _, _ in batch]
+        started = loop.time()
+        # Time spent queued: waiting for the batch to fill and for a free batch slot
+        self._waits.extend(started - queued_at for _, _, queued_at in batch)
+        self.in_flight += len(items)
+        try:
+            results = await loop.run_in_executor(self.executor, self.batch_fn, items)
+        except asyncio.CancelledError:
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(RuntimeError('batcher stopped'))
+            raise
+        except Exception as e:
+            log.exception('Batch of %d failed: %s', len(items), e)
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        finally:
+            self.in_flight -= len(items)
+            self._batch_seconds.append(loop.time() - started)
+            self.batches += 1
+            self.batched_items += len(items)
+            self._slots.release()
+        for (_, fut, _), res in zip(batch, results):
+            if not fut.done():
+                fut.set_result(res)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Build the label index that restricts the classifier to our taxonomy.
+
+Each row of the Lepidoptera and plant taxonomy CSVs is matched to the model's iNat classes
+on scientific name, falling back to every class of the row's genus. The index is written as
+JSON (default `naturalia/label_index.json`); with `LABEL_INDEX` pointing at it the service
+only computes logits for the matched classes and returns our taxon ids with each label.
+Rebuild it whenever the CSVs or the class list change.
+
+Usage:
+    python build_label_index.py --output naturalia/label_index.json
+"""
+import argparse
+import sys
+from pathlib import Path
+
+THIS_DIR = Path(__file__).resolve().parent
+NATURALIA_DIR = THIS_DIR / 'naturalia'
+DATA_DIR = THIS_DIR.parent / 'data'
+if str(NATURALIA_DIR) not in sys.path:
+    sys.path.append(str(NATURALIA_DIR))
+
+from label_index import build_label_index, save_label_index  # noqa: E402
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description='Map our taxonomy CSVs to the model classes')
+    ap.add_argument('--names-path', default=str(NATURALIA_DIR / 'inat_sgd_names.txt'))
+    ap.add_argument('--lepidoptera', default=str(DATA_DIR / 'lepidoptera' / 'lepidoptera_db.csv'))
+    ap.add_argument('--plants', default=str(DATA_DIR / 'plant' / 'plant_db.csv'))
+    ap.add_argument('--output', default=str(NATURALIA_DIR / 'label_index.json'))
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+    with open(args.names_path, encoding='utf-8') as fp:
+        class_names = [line.strip() for line in fp]
+    index = build_label_index(class_names, {'lepidoptera': args.lepidoptera, 'plant': args.plants})
+
+    for source, missing in index['unmatched'].items():
+        matches = [e['match'] for taxon_id, e in index['taxa'].items() if taxon_id.startswith(f'{source}:')]
+        print(f'{source:<12} {matches.count("species"):>6} species  {matches.count("genus"):>6} genus only  '
+              f'{missing:>6} unmatched')
+    print(f'{len(index["classes"])} of {len(class_names)} classes kept')
+    save_label_index(index, args.output)
+    print(f'Wrote {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Pick the early-exit confidence threshold on a validation folder.
+
+Every image runs through both heads once: the early exit on the stage_3 class token and the
+full model. For each candidate threshold the script reports the exit rate, how often exited
+images keep the full model's top-1, the resulting overall top-1 agreement with the full
+model, labelled accuracy when sub-folders are named after classes, and the expected latency
+relative to always running stage_4 (from measured stage timings). It suggests the lowest
+threshold whose overall agreement stays at or above `--min-agreement`.
+
+Calibrate with the same `--label-index` as the service's LABEL_INDEX: a sliced head renormalises
+the softmax over far fewer classes, so confidences (and exit rates) run much higher than on
+the full head. Recalibrate whenever the index is rebuilt.
+
+Usage:
+    python calibrate_early_exit.py --images path/to/validation --min-agreement 0.99
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+THIS_DIR = Path(__file__).resolve().parent
+NATURALIA_DIR = THIS_DIR / 'naturalia'
+if str(NATURALIA_DIR) not in sys.path:
+    sys.path.append(str(NATURALIA_DIR))
+
+from inference import Inference, load_image  # noqa: E402
+
+IMAGE_EXTS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp'}
+THRESHOLDS = [0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.97, 0.99]
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description='Calibrate the stage_3 early-exit confidence threshold')
+    ap.add_argument('--images', required=True, help='validation images (searched recursively)')
+    ap.add_argument('--cfg', default=str(NATURALIA_DIR / 'MetaFG_2_384_inat.yaml'))
+    ap.add_argument('--model-path', default=str(NATURALIA_DIR / 'inat_sgd_6k.pth'))
+    ap.add_argument('--names-path', default=str(NATURALIA_DIR / 'inat_sgd_names.txt'))
+    ap.add_argument('--label-index', help='label index the service runs with (LABEL_INDEX); slices the head the same way')
+    ap.add_argument('--limit', type=int, default=500, help='maximum number of images to evaluate')
+    ap.add_argument('--batch-size', type=int, default=16)
+    ap.add_argument('--min-agreement', type=float, default=0.99,
+                    help='lowest acceptable top-1 agreement with the full model')
+    return ap.parse_args()
+
+
+def normalise_name(name):
+    return name.replace('_', ' ').strip().lower()
+
+
+def stage_costs(model, batch_size, iters=3):
+    """Median seconds per batch for stem..stage_3 and for the whole network."""
+    x = model.example_inputs(batch_size)[0]
+    net = model.model
+
+    def median_s(fn):
+        timings = []
+        for _ in range(iters):
+            start = time.perf_counter()
+            fn(x)
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
+
+    with torch.no_grad():
+        net.forward_both_heads(x)
+        partial = median_s(net.forward_to_stage_3)
+        full = median_s(net)
+    return partial, full
+
+
+def main():
+    args = parse_args()
+    model = Inference(config_path=args.cfg, model_path=args.model_path, names_path=args.names_path,
+                      label_index=args.label_index)
+    if not hasattr(model.model, 'forward_both_heads') or model.config.MODEL.ONLY_LAST_CLS:
+        print(f'{model.config.MODEL.NAME} has no stage_3 class token head to exit from')
+        return 1
+
+    paths = sorted(p for p in Path(args.images).rglob('*') if p.suffix.lower() in IMAGE_EXTS)[:args.limit]
+    if not paths:
+        print(f'No images found under {args.images}')
+        return 1
+
+    exit_conf, exit_top1, full_top1, kept = [], [], [], []
+    for start in range(0, len(paths), args.batch_size):
+        batch, batch_paths = [], []
+        for path in paths[start:start + args.batch_size]:
+            try:
+                batch.append(model.transform_img(load_image(str(path))))
+                batch_paths.append(path)
+            except Exception as e:
+                print(f'Skipping {path}: {e}')
+        if not batch:
+            continue
+        with torch.no_grad():
+            early, full = model.model.forward_both_heads(torch.stack(batch).to(model.device))
+        probs = torch.softmax(early, dim=1)
+        exit_conf.append(probs.max(dim=1).values.cpu().numpy())
+        exit_top1.append(probs.argmax(dim=1).cpu().numpy())
+        full_top1.append(full.argmax(dim=1).cpu().numpy())
+        kept.extend(batch_paths)
+    exit_conf, exit_top1, full_top1 = (np.concatenate(a) for a in (exit_conf, exit_top1, full_top1))
+
+    index = {normalise_name(c): i for i, c in enumerate(model.classes)}
+    labels = np.array([index.get(normalise_name(p.parent.name), -1) for p in kept])
+    labelled = labels >= 0
+
+    partial_s, full_s = stage_costs(model, min(args.batch_size, 4))
+    stage_4_share = max(0.0, 1.0 - partial_s / full_s)
+    scope = f'{len(model.classes)} classes' + (f' of label index {args.label_index}' if args.label_index else '')
+    print(f'{len(kept)} images, {scope}; stage_4 is {stage_4_share:.1%} of a full forward pass')
+    if labelled.any():
+        print(f'full model top-1 accuracy on {labelled.sum()} labelled images: '
+              f'{np.mean(full_top1[labelled] == labels[labelled]):.4f}')
+
+    header = f'{"threshold":>9} {"exit rate":>9} {"exit agree":>10} {"agreement":>9} {"latency":>8}'
+    print(header + (f' {"top-1":>7}' if labelled.any() else ''))
+    suggestion = None
+    for threshold in THRESHOLDS:
+        exited = exit_conf >= threshold
+        served = np.where(exited, exit_top1, full_top1)
+        agreement = np.mean(served == full_top1)
+        exit_agree = np.mean(exit_top1[exited] == full_top1[exited]) if exited.any() else float('nan')
+        latency = 1.0 - exited.mean() * stage_4_share
+        line = f'{threshold:>9.2f} {exited.mean():>9.3f} {exit_agree:>10.3f} {agreement:>9.4f} {latency:>7.1%}'
+        if labelled.any():
+            line += f' {np.mean(served[labelled] == labels[labelled]):>7.4f}'
+        print(line)
+        if suggestion is None and agreement >= args.min_agreement:
+            suggestion = threshold
+
+    if suggestion is None:
+        print(f'No threshold keeps top-1 agreement >= {args.min_agreement}; leave early exit off')
+    else:
+        print(f'Suggested EARLY_EXIT_THRESHOLD={suggestion}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
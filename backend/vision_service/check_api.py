@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Request validation checks for the vision service HTTP API.
+
+Runs the app in MOCK_MODE through FastAPI's TestClient (needs httpx), so no model is
+loaded. Small IMAGE_MAX_BYTES / BATCH_REQUEST_MAX_IMAGES limits are set before `app` is
+imported, so the size checks trip on small bodies. Prints one line per case and exits
+non-zero if any fails.
+
+Usage:
+    python check_api.py
+"""
+import os
+import sys
+
+IMAGE_MAX_BYTES = 1000
+BATCH_REQUEST_MAX_IMAGES = 2
+os.environ.update(MOCK_MODE='1', PREDICTION_CACHE_SIZE='0', IMAGE_MAX_BYTES=str(IMAGE_MAX_BYTES),
+                  BATCH_REQUEST_MAX_IMAGES=str(BATCH_REQUEST_MAX_IMAGES))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import app as service  # noqa: E402
+
+BOUNDARY = 'check-api-boundary'
+
+
+def multipart_body(files, fields=None):
+    """multipart/form-data body with `(filename, bytes)` file parts named `images`."""
+    parts = []
+    for name, value in (fields or {}).items():
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for filename, data in files:
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="images"; filename="{filename}"\r\n'
+                     f'Content-Type: image/jpeg\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{BOUNDARY}--\r\n'.encode())
+    return b''.join(parts)
+
+
+def chunked(body, size=4096):
+    """Body as a generator, so it is sent chunked with no Content-Length."""
+    def chunks():
+        for start in range(0, len(body), size):
+            yield body[start:start + size]
+    return chunks()
+
+
+def post_multipart(client, path, body, stream=False):
+    headers = {'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'}
+    return client.post(path, content=chunked(body) if stream else body, headers=headers)
+
+
+def cases(client):
+    small = b'\xff\xd8\xff' + b'x' * 100
+    limit = BATCH_REQUEST_MAX_IMAGES * (IMAGE_MAX_BYTES + 64 * 1024)
+    yield ('batch multipart, chunked, within limits', 200,
+           post_multipart(client, '/predict/batch', multipart_body([('a.jpg', small), ('b.jpg', small)]), stream=True))
+    yield ('batch multipart, chunked, too many files', 413,
+           post_multipart(client, '/predict/batch',
+                          multipart_body([(f'{i}.jpg', small) for i in range(BATCH_REQUEST_MAX_IMAGES + 1)]), stream=True))
+    yield ('batch multipart, chunked, body over the total cap', 413,
+           post_multipart(client, '/predict/batch', multipart_body([('a.jpg', b'x' * (limit + 1))]), stream=True))
+    yield ('batch multipart, declared length over the total cap', 413,
+           post_multipart(client, '/predict/batch', multipart_body([('a.jpg', b'x' * (limit + 1))])))
+    for top_k, expected in ((3, 200), (0, 422), (-1, 422), (service.TOP_K_MAX + 1, 422)):
+        yield (f'/predict JSON top_k={top_k}', expected,
+               client.post('/predict', json={'imageBase64': 'eA==', 'top_k': top_k}))
+        yield (f'/predict raw body ?top_k={top_k}', expected,
+               client.post('/predict', params={'top_k': top_k}, content=small,
+                           headers={'Content-Type': 'image/jpeg'}))
+        yield (f'/predict multipart top_k={top_k}', expected,
+               post_multipart(client, '/predict', multipart_body([('a.jpg', small)], {'top_k': top_k})))
+        yield (f'/predict/batch JSON top_k={top_k}', expected,
+               client.post('/predict/batch', json={'images': [{'imageBase64': 'eA=='}], 'top_k': top_k}))
+        yield (f'/predict/batch multipart top_k={top_k}', expected,
+               post_multipart(client, '/predict/batch', multipart_body([('a.jpg', small)], {'top_k': top_k})))
+    for path in ('/predict', '/predict/batch'):
+        for body in (b'[1, 2]', b'"text"', b'3', b'null', b'{"top_k": '):
+            yield (f'{path} JSON body {body.decode()}', 422,
+                   client.post(path, content=body, headers={'Content-Type': 'application/json'}))
+
+
+def main():
+    client = TestClient(service.app)
+    failures = 0
+    for name, expected, response in cases(client):
+        ok = response.status_code == expected
+        failures += not ok
+        print(f'{"ok" if ok else "FAIL":<4}  {name}: {response.status_code} (expected {expected})'
+              + ('' if ok else f' {response.text[:200]}'))
+    print(f'{failures} failed' if failures else 'all passed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Check that the inference-time model optimizations reproduce the reference model.
+
+The reference is the eager model exactly as trained (separate BatchNorm layers, bias
+gathered on every call, explicit softmax attention). Each variant is applied to a copy of
+it and run on the same inputs: random tensors by default, or real images with `--images`.
+Reported per variant: the largest absolute logit difference, top-1 agreement and median
+forward latency.
+
+Usage:
+    python check_parity.py --variants fused,sdpa --batch-size 4
+"""
+import argparse
+import copy
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+THIS_DIR = Path(__file__).resolve().parent
+NATURALIA_DIR = THIS_DIR / 'naturalia'
+if str(NATURALIA_DIR) not in sys.path:
+    sys.path.append(str(NATURALIA_DIR))
+
+from inference import Inference, cache_attention_bias, load_image, use_sdpa_attention  # noqa: E402
+
+# name -> in-place transformation of an eager model in eval mode
+VARIANTS = {
+    'fused': lambda model: model.fuse_for_inference(),
+    'cached-bias': cache_attention_bias,
+    'sdpa': use_sdpa_attention,
+}
+IMAGE_EXTS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp'}
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description='Numerical parity of inference optimizations vs the reference model')
+    ap.add_argument('--cfg', default=str(NATURALIA_DIR / 'MetaFG_2_384_inat.yaml'))
+    ap.add_argument('--model-path', default=str(NATURALIA_DIR / 'inat_sgd_6k.pth'))
+    ap.add_argument('--names-path', default=str(NATURALIA_DIR / 'inat_sgd_names.txt'))
+    ap.add_argument('--variants', default=','.join(VARIANTS), help=f'comma-separated subset of {", ".join(VARIANTS)}')
+    ap.add_argument('--images', help='folder of images to use instead of random inputs')
+    ap.add_argument('--batch-size', type=int, default=4)
+    ap.add_argument('--iters', type=int, default=3, help='timed forward passes per variant')
+    ap.add_argument('--atol', type=float, default=1e-3, help='largest acceptable logit difference')
+    return ap.parse_args()
+
+
+def make_inputs(reference, args):
+    if not args.images:
+        torch.manual_seed(0)
+        return torch.randn(args.batch_size, 3, reference.img_size, reference.img_size)
+    paths = sorted(p for p in Path(args.images).rglob('*') if p.suffix.lower() in IMAGE_EXTS)
+    images = [reference.transform_img(load_image(str(p))) for p in paths[:args.batch_size]]
+    if not images:
+        raise SystemExit(f'No images found under {args.images}')
+    return torch.stack(images)
+
+
+def run(model, inputs, meta, iters):
+    """Logits of the first pass and the median latency in ms of `iters` further passes."""
+    timings = []
+    with torch.no_grad():
+        logits = model(inputs, meta)
+        for _ in range(iters):
+            start = time.perf_counter()
+            model(inputs, meta)
+            timings.append((time.perf_counter() - start) * 1000)
+    return logits, statistics.median(timings) if timings else float('nan')
+
+
+def main():
+    args = parse_args()
+    names = [v for v in args.variants.split(',') if v]
+    unknown = [v for v in names if v not in VARIANTS]
+    if unknown:
+        print(f'Unknown variants: {", ".join(unknown)} (known: {", ".join(VARIANTS)})')
+        return 2
+
+    reference = Inference(config_path=args.cfg, model_path=args.model_path, names_path=args.names_path,
+                          cache_bias=False, fuse=False)
+    inputs = make_inputs(reference, args)
+    meta = reference.text_meta(str(NATURALIA_DIR / 'meta.txt'), batch_size=inputs.shape[0])
+    expected, ref_ms = run(reference.model, inputs, meta, args.iters)
+    print(f'{"variant":<12} {"max |diff|":>11} {"top-1 agree":>11} {"median ms":>10}')
+    print(f'{"reference":<12} {0.0:>11.2e} {1.0:>11.3f} {ref_ms:>10.1f}')
+
+    failed = []
+    for name in names:
+        model = copy.deepcopy(reference.model)
+        VARIANTS[name](model)
+        logits, ms = run(model, inputs, meta, args.iters)
+        diff = (logits - expected).abs().max().item()
+        agree = (logits.argmax(1) == expected.argmax(1)).float().mean().item()
+        print(f'{name:<12} {diff:>11.2e} {agree:>11.3f} {ms:>10.1f}')
+        if diff > args.atol:
+            failed.append(name)
+        del model
+
+    if failed:
+        print(f'Outside tolerance {args.atol}: {", ".join(failed)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Compare the int8 dynamically quantized model against fp32 on a folder of images.
+
+Both models are built from the same checkpoint and run over the same decoded images.
+Reported per model: throughput (images/s). Reported for int8 vs fp32: top-1 agreement,
+how often the fp32 top-1 is still in the int8 top-5, and the mean absolute difference of
+the fp32 top-1 probability. If images sit in sub-folders named after a class (e.g.
+`Danaus plexippus/` or `danaus_plexippus/`), labelled top-1/top-5 accuracy is reported too.
+
+Usage:
+    python check_quantization.py --images path/to/held_out --limit 500
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+THIS_DIR = Path(__file__).resolve().parent
+NATURALIA_DIR = THIS_DIR / 'naturalia'
+if str(NATURALIA_DIR) not in sys.path:
+    sys.path.append(str(NATURALIA_DIR))
+
+from inference import Inference, load_image  # noqa: E402
+
+IMAGE_EXTS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp'}
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description='Accuracy and throughput of int8 dynamic quantization vs fp32')
+    ap.add_argument('--images', required=True, help='folder of held-out images (searched recursively)')
+    ap.add_argument('--cfg', default=str(NATURALIA_DIR / 'MetaFG_2_384_inat.yaml'))
+    ap.add_argument('--model-path', default=str(NATURALIA_DIR / 'inat_sgd_6k.pth'))
+    ap.add_argument('--names-path', default=str(NATURALIA_DIR / 'inat_sgd_names.txt'))
+    ap.add_argument('--meta-path', default=str(NATURALIA_DIR / 'meta.txt'))
+    ap.add_argument('--limit', type=int, default=200, help='maximum number of images to evaluate')
+    ap.add_argument('--batch-size', type=int, default=16)
+    return ap.parse_args()
+
+
+def load_images(folder, limit):
+    paths = sorted(p for p in Path(folder).rglob('*') if p.suffix.lower() in IMAGE_EXTS)[:limit]
+    images = []
+    for path in paths:
+        try:
+            images.append((path, load_image(str(path))))
+        except Exception as e:
+            print(f'Skipping {path}: {e}')
+    return images
+
+
+def normalise_name(name):
+    return name.replace('_', ' ').strip().lower()
+
+
+def run(model, images, batch_size, meta_path):
+    """Top-5 per image and the throughput of the whole pass (after one warm-up batch)."""
+    model.warmup(batch_size=min(batch_size, len(images)))
+    preds = []
+    start = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        batch = [img for _, img in images[i:i + batch_size]]
+        preds.extend(model.infer_batch(batch, topk=5, meta_data_path=meta_path, compact=True))
+    elapsed = time.perf_counter() - start
+    return preds, len(images) / elapsed
+
+
+def main():
+    args = parse_args()
+    images = load_images(args.images, args.limit)
+    if not images:
+        print(f'No images found under {args.images}')
+        return 1
+    print(f'Evaluating {len(images)} images')
+
+    results = {}
+    for name, quantize in (('fp32', False), ('int8', True)):
+        model = Inference(config_path=args.cfg, model_path=args.model_path,
+                          names_path=args.names_path, quantize=quantize)
+        preds, ips = run(model, images, args.batch_size, args.meta_path)
+        results[name] = preds
+        print(f'{name}: {ips:.2f} images/s (batch size {args.batch_size})')
+        classes = model.classes
+        del model
+
+    fp32, int8 = results['fp32'], results['int8']
+    top1_agree = np.mean([a.indices[0] == b.indices[0] for a, b in zip(fp32, int8)])
+    in_top5 = np.mean([a.indices[0] in b.indices for a, b in zip(fp32, int8)])
+    prob_diff = []
+    for a, b in zip(fp32, int8):
+        hit = np.nonzero(b.indices == a.indices[0])[0]
+        # Outside the int8 top-5 the probability is at most its 5th score
+        prob_diff.append(abs(a.scores[0] - (b.scores[hit[0]] if hit.size else b.scores[-1])))
+    print(f'int8 vs fp32: top-1 agreement {top1_agree:.4f}, fp32 top-1 in int8 top-5 {in_top5:.4f}, '
+          f'mean |delta p(top-1)| {np.mean(prob_diff):.5f}')
+
+    # Labelled accuracy when the parent folder names a class
+    index = {normalise_name(c): i for i, c in enumerate(classes)}
+    labels = [index.get(normalise_name(path.parent.name)) for path, _ in images]
+    labelled = [i for i, label in enumerate(labels) if label is not None]
+    if labelled:
+        for name, preds in results.items():
+            top1 = np.mean([preds[i].indices[0] == labels[i] for i in labelled])
+            top5 = np.mean([labels[i] in preds[i].indices for i in labelled])
+            print(f'{name}: top-1 {top1:.4f}, top-5 {top5:.4f} on {len(labelled)} labelled images')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
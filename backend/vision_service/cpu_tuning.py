@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+CPU sizing for the vision service, and a thread-count benchmark.
+
+PyTorch starts one OpenMP team per process sized to every core on the host, ignoring
+container CPU quotas. Each concurrent forward pass uses the whole team, and so does every
+forked worker, so the service oversubscribes the CPU. The helpers here find the CPUs a
+process may really use (affinity mask and cgroup v1/v2 quota), split them between
+workers and concurrent forward passes, and pin forked workers to disjoint cores.
+
+Run as a script, it sweeps torch thread counts against batch sizes on the real model:
+
+    python cpu_tuning.py --threads 1,2,4,8 --batch-sizes 1,4,8
+"""
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+NATURALIA_DIR = Path(__file__).resolve().parent / 'naturalia'
+
+
+def cgroup_cpu_quota():
+    """CPUs granted by the cgroup CPU quota (may be fractional), or None without a quota."""
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open('/sys/fs/cgroup/cpu.max') as fp:
+            quota, period = fp.read().split()[:2]
+        return None if quota == 'max' else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as fp:
+            quota = int(fp.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as fp:
+            period = int(fp.read())
+        return None if quota <= 0 or period <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def affinity_cpus():
+    """Sorted CPU ids this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def available_cpus():
+    """Whole CPUs this process can keep busy: the affinity mask, capped by the cgroup quota.
+
+    A fractional quota rounds down, since threads beyond it only get throttled.
+    """
+    cpus = len(affinity_cpus())
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.floor(quota)))
+    return cpus
+
+
+def worker_cpus(worker_id, workers, cpus=None):
+    """Contiguous slice of `cpus` (default: the affinity mask) for worker `worker_id` of `workers`.
+
+    Extra CPUs go to the first workers; with more workers than CPUs, slices wrap around.
+    """
+    cpus = affinity_cpus() if cpus is None else list(cpus)
+    if workers >= len(cpus):
+        return [cpus[worker_id % len(cpus)]]
+    size, extra = divmod(len(cpus), workers)
+    start = worker_id * size + min(worker_id, extra)
+    return cpus[start:start + size + (1 if worker_id < extra else 0)]
+
+
+def pin_to_cpus(cpus):
+    """Restrict the calling process (and threads it starts later) to `cpus`; False where unsupported."""
+    if not hasattr(os, 'sched_setaffinity'):
+        return False
+    os.sched_setaffinity(0, cpus)
+    return True
+
+
+def configure_torch_threads(intra_op, inter_op=None):
+    """Set torch's intra-op (OpenMP) and inter-op pool sizes; returns the sizes in effect.
+
+    The inter-op size can only be set before torch first uses that pool, so a later call
+    keeps the existing value.
+    """
+    import torch
+
+    torch.set_num_threads(max(1, intra_op))
+    if inter_op is not None:
+        try:
+            torch.set_num_interop_threads(max(1, inter_op))
+        except RuntimeError:
+            pass
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description='Sweep torch thread counts against batch sizes')
+    ap.add_argument('--cfg', default=str(NATURALIA_DIR / 'MetaFG_2_384_inat.yaml'))
+    ap.add_argument('--model-path', default=str(NATURALIA_DIR / 'inat_sgd_6k.pth'))
+    ap.add_argument('--names-path', default=str(NATURALIA_DIR / 'inat_sgd_names.txt'))
+    ap.add_argument('--threads', help='comma-separated intra-op thread counts (default: powers of 2 up to the CPU budget)')
+    ap.add_argument('--batch-sizes', default='1,4,8', help='comma-separated batch sizes')
+    ap.add_argument('--iters', type=int, default=5, help='timed forward passes per combination')
+    ap.add_argument('--img-size', type=int, help='run at this resolution instead of the config IMG_SIZE')
+    return ap.parse_args()
+
+
+def benchmark():
+    args = parse_args()
+    budget = available_cpus()
+    quota = cgroup_cpu_quota()
+    print(f'affinity: {len(affinity_cpus())} CPUs, cgroup quota: {"none" if quota is None else f"{quota:g}"} '
+          f'-> budget {budget}')
+    if args.threads:
+        thread_counts = [int(t) for t in args.threads.split(',') if t]
+    else:
+        thread_counts = sorted({min(2 ** i, budget) for i in range(budget.bit_length())} | {budget})
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',') if b]
+
+    if str(NATURALIA_DIR) not in sys.path:
+        sys.path.append(str(NATURALIA_DIR))
+    import torch
+    from inference import Inference
+
+    configure_torch_threads(budget, 1)
+    model = Inference(config_path=args.cfg, model_path=args.model_path, names_path=args.names_path,
+                      img_size=args.img_size)
+    print(f'{model.config.MODEL.NAME} at {model.img_size}px, {args.iters} timed passes each')
+    print(f'{"threads":>7}  {"batch":>5}  {"median ms":>10}  {"img/s":>8}')
+    best = {}
+    for threads in thread_counts:
+        torch.set_num_threads(threads)
+        for batch_size in batch_sizes:
+            inputs = model.example_inputs(batch_size)
+            timings = []
+            with torch.no_grad():
+                model.forward(*inputs)
+                for _ in range(args.iters):
+                    start = time.perf_counter()
+                    model.forward(*inputs)
+                    timings.append(time.perf_counter() - start)
+            median = statistics.median(timings)
+            throughput = batch_size / median
+            print(f'{threads:>7}  {batch_size:>5}  {median * 1000:>10.1f}  {throughput:>8.2f}')
+            if throughput > best.get(batch_size, (0, 0))[1]:
+                best[batch_size] = (threads, throughput)
+    for batch_size, (threads, throughput) in best.items():
+        print(f'batch {batch_size}: best at {threads} threads ({throughput:.2f} img/s)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(benchmark())
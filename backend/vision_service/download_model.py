@@ -4,10 +4,12 @@ Download the model files from Hugging Face and copy them into `iNatAPI/naturalia
 
 Run from this folder:
   python download_model.py
+  python download_model.py --convert   # also write an inference-only, mmap-friendly weights file
 
 Requires: `huggingface_hub` installed in the active environment and optionally
 the env var HUGGINGFACE_TOKEN set if the model requires authentication.
 """
+import argparse
 import os
 import shutil
 from pathlib import Path
@@ -18,7 +20,41 @@ REPO = "joshvm/inaturalist_sgd_4k"
 FILES = ["inat_sgd_6k.pth", "MetaFG_2_384_inat.yaml", "inat_sgd_names.txt"]
 
 
+def inference_weights_path(model_path):
+    """Where the inference-only copy of `model_path` lives (`foo.pth` -> `foo.inference.pth`)."""
+    model_path = Path(model_path)
+    return model_path.with_name(model_path.stem + ".inference.pth")
+
+
+def convert_checkpoint(src, dest=None):
+    """Write an inference-only copy of a training checkpoint.
+
+    Only the model tensors are kept (no optimizer/scheduler state or pickled config), saved
+    contiguously in torch's zip format so `Inference` can memory-map them with
+    `torch.load(..., mmap=True, weights_only=True)` and adopt them without a copy.
+    """
+    import torch
+
+    dest = Path(dest) if dest is not None else inference_weights_path(src)
+    # Trusted source: the training checkpoint pickles its config alongside the weights
+    checkpoint = torch.load(src, map_location="cpu", weights_only=False)
+    state = checkpoint["model"] if "model" in checkpoint else checkpoint
+    state = {k: v.contiguous() for k, v in state.items() if torch.is_tensor(v)}
+    del checkpoint
+
+    # Write next to the destination and rename so a crash never leaves a truncated file behind
+    tmp = dest.with_name(dest.name + ".tmp")
+    torch.save(state, tmp)
+    os.replace(tmp, dest)
+    return dest
+
+
 def main():
+    ap = argparse.ArgumentParser(description="Download the vision model files into the vendored naturalia folder")
+    ap.add_argument("--convert", action="store_true",
+                    help="also write an inference-only, mmap-friendly copy of the weights")
+    args = ap.parse_args()
+
     script_path = Path(__file__).resolve()
     # Place downloaded files into the vendored naturalia folder inside this service
     script_dir = script_path.parent
@@ -47,6 +83,16 @@ def main():
             return 1
 
     print("All files downloaded and copied to:", target_dir)
+
+    if args.convert:
+        src = target_dir / FILES[0]
+        print(f"Converting {src} to an inference-only weights file ...")
+        try:
+            dest = convert_checkpoint(src)
+        except Exception as e:
+            print(f"Failed to convert {src}: {e}")
+            return 1
+        print(f"Wrote {dest}")
     return 0
 
 
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Export the MetaFG inference model to ONNX for the onnxruntime backend.
+
+The graph is exported at the config's IMG_SIZE with a dynamic batch dimension and written
+next to the weights as `<model>.onnx`, where the service picks it up with
+`INFERENCE_BACKEND=onnx`. The export is checked against the PyTorch model, and per-batch
+CPU latency of both is reported.
+
+Usage:
+    python export_onnx.py --threads 4 --batch-sizes 1,8
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+THIS_DIR = Path(__file__).resolve().parent
+NATURALIA_DIR = THIS_DIR / 'naturalia'
+if str(NATURALIA_DIR) not in sys.path:
+    sys.path.append(str(NATURALIA_DIR))
+
+from inference import Inference, export_onnx  # noqa: E402
+from onnx_backend import OnnxInference  # noqa: E402
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description='Export MetaFG to ONNX and compare onnxruntime with PyTorch')
+    ap.add_argument('--cfg', default=str(NATURALIA_DIR / 'MetaFG_2_384_inat.yaml'))
+    ap.add_argument('--model-path', default=str(NATURALIA_DIR / 'inat_sgd_6k.pth'))
+    ap.add_argument('--names-path', default=str(NATURALIA_DIR / 'inat_sgd_names.txt'))
+    ap.add_argument('--output', help='ONNX file to write (default: <model-path stem>.onnx)')
+    ap.add_argument('--label-index', help='slice the head to the classes of this label index (LABEL_INDEX)')
+    ap.add_argument('--opset', type=int, default=17)
+    ap.add_argument('--threads', type=int, default=0, help='onnxruntime intra-op threads (0 = default)')
+    ap.add_argument('--batch-sizes', default='1,8', help='comma-separated batch sizes to time')
+    ap.add_argument('--iters', type=int, default=10, help='timed forward passes per batch size')
+    return ap.parse_args()
+
+
+def median_ms(fn, iters):
+    fn()
+    timings = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    args = parse_args()
+    output = args.output or str(Path(args.model_path).with_suffix('.onnx'))
+
+    model = Inference(config_path=args.cfg, model_path=args.model_path, names_path=args.names_path,
+                      label_index=args.label_index)
+    if model.needs_text_meta:
+        print(f'{model.config.MODEL.NAME} takes BERT meta tokens; only image-only models can be exported')
+        return 1
+    start = time.perf_counter()
+    export_onnx(model.model, model.example_inputs(), output, opset_version=args.opset)
+    print(f'Exported {output} at {model.img_size}px in {time.perf_counter() - start:.1f}s')
+
+    session = OnnxInference(output, args.names_path, intra_op_threads=args.threads, label_index=args.label_index)
+    batch = torch.randn(2, 3, model.img_size, model.img_size)
+    with torch.no_grad():
+        expected = model.forward(batch).numpy()
+    diff = np.abs(expected - session.forward(batch.numpy())).max()
+    print(f'max |torch - onnxruntime| logit difference: {diff:.2e}')
+
+    print(f'{"batch":>5}  {"torch ms":>10}  {"ort ms":>10}  {"speedup":>7}')
+    for batch_size in [int(b) for b in args.batch_sizes.split(',') if b]:
+        inputs = torch.randn(batch_size, 3, model.img_size, model.img_size)
+        arr = inputs.numpy()
+        with torch.no_grad():
+            torch_ms = median_ms(lambda: model.forward(inputs), args.iters)
+        ort_ms = median_ms(lambda: session.forward(arr), args.iters)
+        print(f'{batch_size:>5}  {torch_ms:>10.1f}  {ort_ms:>10.1f}  {torch_ms / ort_ms:>6.2f}x')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
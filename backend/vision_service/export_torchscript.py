@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Export the MetaFG inference model to a frozen TorchScript graph and compare its CPU
+latency with the eager model.
+
+The export is traced at the config's IMG_SIZE and cached next to the weights (see
+`torchscript_cache_path`), where `Inference(torchscript=True)` / `TORCHSCRIPT=1` pick it up
+instead of building the eager model. Re-running reuses a fresh cache unless `--force`.
+
+Usage:
+    python export_torchscript.py --batch-sizes 1,8 --iters 20
+"""
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+THIS_DIR = Path(__file__).resolve().parent
+NATURALIA_DIR = THIS_DIR / 'naturalia'
+if str(NATURALIA_DIR) not in sys.path:
+    sys.path.append(str(NATURALIA_DIR))
+
+from inference import Inference, torchscript_cache_path  # noqa: E402
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description='Export MetaFG to TorchScript and report latency vs eager')
+    ap.add_argument('--cfg', default=str(NATURALIA_DIR / 'MetaFG_2_384_inat.yaml'))
+    ap.add_argument('--model-path', default=str(NATURALIA_DIR / 'inat_sgd_6k.pth'))
+    ap.add_argument('--names-path', default=str(NATURALIA_DIR / 'inat_sgd_names.txt'))
+    ap.add_argument('--quantize', action='store_true', help='export the int8 dynamically quantized model')
+    ap.add_argument('--label-index', help='slice the head to the classes of this label index (LABEL_INDEX)')
+    ap.add_argument('--force', action='store_true', help='re-export even if a cached artifact is up to date')
+    ap.add_argument('--batch-sizes', default='1,8', help='comma-separated batch sizes to time')
+    ap.add_argument('--iters', type=int, default=10, help='timed forward passes per batch size')
+    return ap.parse_args()
+
+
+def time_forward(model, batch_size, iters):
+    """Median and p90 latency in ms of `iters` forward passes after two warm-up passes."""
+    inputs = model.example_inputs(batch_size)
+    timings = []
+    with torch.no_grad():
+        for i in range(iters + 2):
+            start = time.perf_counter()
+            model.forward(*inputs)
+            if i >= 2:
+                timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    # Nearest-rank p90: the smallest timing at or above 90% of the passes
+    return statistics.median(timings), timings[math.ceil(0.9 * len(timings)) - 1]
+
+
+def main():
+    args = parse_args()
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',') if b]
+
+    kwargs = dict(config_path=args.cfg, model_path=args.model_path, names_path=args.names_path,
+                  quantize=args.quantize, label_index=args.label_index)
+    eager = Inference(**kwargs)
+    path = torchscript_cache_path(args.model_path, eager.config.DATA.IMG_SIZE, args.quantize,
+                                  label_index=eager.label_index)
+    if args.force and os.path.exists(path):
+        os.remove(path)
+
+    start = time.perf_counter()
+    scripted = Inference(torchscript=True, **kwargs)
+    print(f'TorchScript model ready in {time.perf_counter() - start:.1f}s: {path}')
+
+    # Same weights, same inputs: outputs should match to float tolerance
+    inputs = eager.example_inputs(2)
+    with torch.no_grad():
+        inputs = (torch.randn_like(inputs[0]),) + inputs[1:]
+        diff = (eager.forward(*inputs) - scripted.forward(*inputs)).abs().max().item()
+    print(f'max |eager - torchscript| logit difference: {diff:.2e}')
+
+    print(f'CPU threads: {torch.get_num_threads()}')
+    print(f'{"batch":>5}  {"eager ms":>10}  {"eager p90":>10}  {"script ms":>10}  {"script p90":>10}  {"speedup":>7}')
+    for batch_size in batch_sizes:
+        eager_ms, eager_p90 = time_forward(eager, batch_size, args.iters)
+        script_ms, script_p90 = time_forward(scripted, batch_size, args.iters)
+        print(f'{batch_size:>5}  {eager_ms:>10.1f}  {eager_p90:>10.1f}  {script_ms:>10.1f}  {script_p90:>10.1f}  '
+              f'{eager_ms / script_ms:>6.2f}x')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
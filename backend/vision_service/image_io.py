@@ -0,0 +1,206 @@
+"""
+Image loading helpers for the vision service.
+
+`ImageFetcher` downloads `imageUrl` payloads on the event loop through one shared,
+pooled aiohttp session, so a slow storage URL only holds its own request. Bodies
+are streamed into memory up to a size cap, as are raw and multipart upload bodies
+(`read_stream`, `MultipartImage`). Decoding is plain blocking PIL work and is meant
+to run in a worker pool (see `decode_base64` / `decode_image`).
+"""
+import base64
+import io
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aiohttp
+from PIL import Image
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+log = logging.getLogger("inat-vision-service.image_io")
+
+
+class ImageTooLarge(ValueError):
+    """Raised when an image payload exceeds the configured byte limit."""
+
+
+class TooManyImages(ValueError):
+    """Raised by `MultipartImage` when a body carries more than `max_images` file parts."""
+
+
+async def read_stream(chunks: AsyncIterator[bytes], max_bytes: int) -> bytearray:
+    """Collect a stream of body chunks into one buffer, raising ImageTooLarge past `max_bytes`."""
+    buf = bytearray()
+    async for chunk in chunks:
+        buf += chunk
+        if len(buf) > max_bytes:
+            raise ImageTooLarge(f'image exceeds {max_bytes} bytes')
+    return buf
+
+
+class MultipartImage:
+    """Incremental multipart/form-data reader for image uploads.
+
+    Feed body chunks to `write`. Up to `max_images` file parts are collected in `files` as
+    `(filename, bytearray)`, each capped at `max_bytes`; short text parts such as `top_k` land
+    in `fields`. Nothing is spooled to disk or held twice. An image over `max_bytes` raises
+    ImageTooLarge, or with `skip_oversized` is kept as `(filename, None)` while the rest of
+    the body is still read; `max_total_bytes` caps the whole body either way.
+    """
+    def __init__(self, content_type: str, max_bytes: int, max_field_bytes: int = 1024, max_images: int = 1,
+                 skip_oversized: bool = False, max_total_bytes: Optional[int] = None):
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b'boundary')
+        if not boundary:
+            raise ValueError('multipart body without a boundary')
+        self.max_bytes = max_bytes
+        self.max_field_bytes = max_field_bytes
+        self.max_images = max_images
+        self.skip_oversized = skip_oversized
+        self.max_total_bytes = max_total_bytes
+        self.files: List[Tuple[str, Optional[bytearray]]] = []
+        self.fields: Dict[str, str] = {}
+        self._received = 0
+        self._header_field = b''
+        self._header_value = b''
+        self._disposition = b''
+        self._target = None
+        self._limit = 0
+        self._field_name = None
+        self._parser = MultipartParser(boundary, {
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+        })
+
+    @property
+    def image(self) -> Optional[bytearray]:
+        """The first image, for single-image uploads."""
+        return self.files[0][1] if self.files else None
+
+    def write(self, chunk: bytes):
+        self._received += len(chunk)
+        if self.max_total_bytes is not None and self._received > self.max_total_bytes:
+            raise ImageTooLarge(f'multipart body exceeds {self.max_total_bytes} bytes')
+        self._parser.write(chunk)
+
+    def _on_part_begin(self):
+        self._disposition = b''
+        self._target = None
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        if self._header_field.lower() == b'content-disposition':
+            self._disposition = self._header_value
+        self._header_field = b''
+        self._header_value = b''
+
+    def _on_headers_finished(self):
+        _, params = parse_options_header(self._disposition)
+        if b'filename' in params:
+            if len(self.files) >= self.max_images:
+                raise TooManyImages('only one image file per request' if self.max_images == 1
+                                    else f'at most {self.max_images} images per request')
+            self._target = bytearray()
+            self.files.append((params[b'filename'].decode('utf-8', 'replace'), self._target))
+            self._limit = self.max_bytes
+        else:
+            self._field_name = params.get(b'name', b'').decode('utf-8', 'replace')
+            self._target = bytearray()
+            self._limit = self.max_field_bytes
+
+    def _is_file(self):
+        return bool(self.files) and self._target is self.files[-1][1]
+
+    def _on_part_data(self, data, start, end):
+        if self._target is None:
+            # Rest of a skipped oversized image
+            return
+        self._target += data[start:end]
+        if len(self._target) > self._limit:
+            if not self._is_file():
+                raise ValueError(f'form field {self._field_name!r} exceeds {self.max_field_bytes} bytes')
+            if not self.skip_oversized:
+                raise ImageTooLarge(f'image exceeds {self.max_bytes} bytes')
+            self.files[-1] = (self.files[-1][0], None)
+            self._target = None
+
+    def _on_part_end(self):
+        if self._target is not None and not self._is_file():
+            self.fields[self._field_name] = self._target.decode('utf-8', 'replace')
+        self._target = None
+
+
+class ImageFetcher:
+    def __init__(self, max_bytes: int = 20 * 1024 * 1024, timeout: float = 20.0,
+                 max_connections: int = 64, max_connections_per_host: int = 8,
+                 chunk_size: int = 64 * 1024):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.chunk_size = chunk_size
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Created lazily so it binds to the running event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections,
+                                             limit_per_host=self.max_connections_per_host)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def fetch(self, url: str) -> bytearray:
+        """Download `url` and return its body, raising ImageTooLarge past `max_bytes`.
+
+        Cancelling the awaiting task (client disconnect, timeout) aborts the download
+        and returns the connection to the pool.
+        """
+        session = self._get_session()
+        async with session.get(url) as resp:
+            resp.raise_for_status()
+            if resp.content_length is not None and resp.content_length > self.max_bytes:
+                raise ImageTooLarge(f'image is {resp.content_length} bytes, limit is {self.max_bytes}')
+            return await read_stream(resp.content.iter_chunked(self.chunk_size), self.max_bytes)
+
+
+def decode_image(data, min_size: Optional[int] = None) -> Image.Image:
+    """Decode raw image bytes into an RGB PIL image (blocking; run in a worker pool).
+
+    With `min_size`, a JPEG is decoded at the smallest 1/2, 1/4 or 1/8 DCT scale that is still
+    at least `min_size` on both sides (PIL draft mode).
+    """
+    img = Image.open(io.BytesIO(data))
+    if min_size is not None and img.format == 'JPEG':
+        img.draft('RGB', (min_size, min_size))
+    return img.convert('RGB')
+
+
+def decode_base64(b64: str, max_bytes: Optional[int] = None) -> bytes:
+    """Decode a raw base64 string or data URL into image bytes (blocking)."""
+    if b64.startswith('data:'):
+        b64 = b64.split(',', 1)[1]
+    # base64 inflates by 4/3, so the encoded length bounds the decoded size
+    if max_bytes is not None and len(b64) * 3 // 4 > max_bytes:
+        raise ImageTooLarge(f'image exceeds {max_bytes} bytes')
+    return base64.b64decode(b64)
+
@@ -0,0 +1,82 @@
+"""
+Prometheus metrics for the vision service, exposed at `/metrics`.
+
+`vision_stage_seconds{stage=...}` times each image's fetch (download or upload body), decode and
+queue_wait (submitted until its batch starts), and each batch's preprocess, forward and
+postprocess. Alongside: request latency, batch sizes, prediction cache hits, admission
+rejections, queue depth, model load time and resident memory.
+
+Under serve.py, set PROMETHEUS_MULTIPROC_DIR to an empty directory so each scrape reports all
+workers combined instead of whichever worker accepted it.
+"""
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, \
+    generate_latest
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+# 5 ms .. 60 s: decode of a small JPEG up to a cold forward pass at 384px on a busy CPU
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram('vision_stage_seconds', 'Time spent per image in each /predict stage',
+                          ['stage'], buckets=SECONDS_BUCKETS)
+REQUEST_SECONDS = Histogram('vision_request_seconds', 'End-to-end latency of classification requests',
+                            ['endpoint'], buckets=SECONDS_BUCKETS)
+BATCH_SIZE = Histogram('vision_batch_size', 'Images per forward pass', ['tier'],
+                       buckets=(1, 2, 4, 8, 16, 32, 64))
+CACHE_REQUESTS = Counter('vision_prediction_cache_requests', 'Prediction cache lookups', ['result'])
+REJECTED = Counter('vision_rejected_images', 'Images refused by admission control', ['tier'])
+QUEUE_DEPTH = Gauge('vision_queue_depth', 'Images waiting for a forward pass', ['tier'],
+                    multiprocess_mode='livesum')
+MODEL_LOAD_SECONDS = Gauge('vision_model_load_seconds', 'Time taken by the last model load (all tiers)',
+                           multiprocess_mode='max')
+RESIDENT_MEMORY = Gauge('vision_resident_memory_bytes', 'Resident set size of the serving process',
+                        multiprocess_mode='liveall')
+
+
+def resident_memory_bytes():
+    """Current RSS from /proc, or the peak RSS where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def timed(stage):
+    """Observe the duration of the enclosed block as `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def observe_stages(timings):
+    """Observe a `{stage: seconds}` dict such as `Inference.infer_batch(timings=...)` fills."""
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def render():
+    """(body, content type) of the current metrics, combined across workers in multiprocess mode."""
+    RESIDENT_MEMORY.set(resident_memory_bytes())
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Drop a dead worker's live gauges (multiprocess mode only)."""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
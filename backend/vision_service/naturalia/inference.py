@@ -1,15 +1,22 @@
-from transformers import AutoTokenizer, AutoModel
 import torch
 from PIL import Image
 from config import get_inference_config
 from models import build_model
-from torch.autograd import Variable
+from models.MHSA import Relative_Attention
+from label_index import LabelIndex
+from preprocess import decode_to_tensor, draft, pil_to_tensor, preprocess_batch
+from utils import relative_bias_interpolate
 from torchvision.transforms import transforms
 import numpy as np
+from collections import namedtuple
 import argparse
 from pycocotools.coco import COCO
 import requests
+import inspect
+import io
 import os
+import pickle
+import time
 from tqdm.auto import tqdm
 
 try:
@@ -19,6 +26,10 @@ except ImportError:
 
 IMAGENET_DEFAULT_MEAN = (0.485, 0.456, 0.406)
 IMAGENET_DEFAULT_STD = (0.229, 0.224, 0.225)
+# Compact prediction: parallel arrays of class indices (int64) and scores (float32), best first
+TopK = namedtuple('TopK', ['indices', 'scores'])
+# Hidden size of bert-base-uncased; MetaFG_meta_bert configs declare it in MODEL.META_DIMS
+BERT_META_DIM = 768
 
 
 class Namespace:
@@ -56,8 +67,194 @@ def read_class_names_coco(file_path):
 
     return classes
 
+def load_image(img, min_size=None):
+    """Open an image given as a PIL image, raw bytes, a file-like object, a path or an http(s) URL.
+
+    With `min_size`, large JPEGs are decoded at a reduced scale still covering it (`preprocess.draft`).
+    """
+    if isinstance(img, Image.Image):
+        return img if img.mode == 'RGB' else img.convert('RGB')
+    if isinstance(img, (bytes, bytearray, memoryview)):
+        img = Image.open(io.BytesIO(img))
+    elif hasattr(img, 'read'):
+        img = Image.open(img)
+    elif str(img).startswith("http"):
+        img = Image.open(requests.get(str(img), stream=True).raw)
+    else:
+        img = Image.open(str(img))
+    draft(img, min_size)
+    return img.convert('RGB')
+
+def load_image_tensor(img, min_size=None):
+    """`load_image` as an RGB uint8 (3, H, W) tensor; tensors pass through, raw bytes skip PIL for JPEGs."""
+    if isinstance(img, torch.Tensor):
+        return img
+    if isinstance(img, (bytes, bytearray, memoryview)):
+        return decode_to_tensor(img, min_size)
+    return pil_to_tensor(load_image(img, min_size))
+
+def load_weights(model_path):
+    """Load a model state dict, memory-mapping the file when its format allows it.
+
+    Accepts full training checkpoints (weights under 'model') as well as the inference-only
+    files written by `download_model.py --convert`. Returns (state_dict, mmapped).
+    """
+    checkpoint = None
+    mmapped = False
+    try:
+        # Inference-only files hold nothing but tensors and load without unpickling arbitrary objects
+        checkpoint = torch.load(model_path, map_location='cpu', mmap=True, weights_only=True)
+        mmapped = True
+    except TypeError:
+        # PyTorch < 2.1: no mmap support
+        pass
+    except RuntimeError:
+        # Legacy (non-zip) serialization cannot be memory-mapped
+        pass
+    except pickle.UnpicklingError:
+        # Full training checkpoints pickle config/optimizer objects; still map the tensors
+        try:
+            checkpoint = torch.load(model_path, map_location='cpu', mmap=True, weights_only=False)
+            mmapped = True
+        except (TypeError, RuntimeError):
+            pass
+    if checkpoint is None:
+        # PyTorch 2.6+ defaults weights_only=True; allow loading full checkpoint from trusted source
+        checkpoint = torch.load(model_path, map_location='cpu', weights_only=False)
+
+    if 'model' in checkpoint:
+        return checkpoint['model'], mmapped
+    return checkpoint, mmapped
+
+
+def quantize_dynamic_int8(model):
+    """Replace every nn.Linear with a dynamically quantized int8 equivalent (CPU only).
+
+    Weights are quantized once; activations are quantized per batch at run time, so no
+    calibration data is needed. Covers the MHSA qkv/proj, Mlp and classifier head layers.
+    """
+    try:
+        from torch.ao.quantization import quantize_dynamic
+    except ImportError:
+        # PyTorch < 1.10
+        from torch.quantization import quantize_dynamic
+    return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def torchscript_cache_path(model_path, img_size, quantized=False, sdpa=False, label_index=None):
+    """Where the TorchScript export of `model_path` is cached.
+
+    The name pins everything the traced graph depends on: input size, quantization, attention
+    kernel, the classes kept in the head and the PyTorch version that serialized it
+    (TorchScript files are not portable across versions).
+    """
+    stem, _ = os.path.splitext(model_path)
+    variant = f"{img_size}px" + ("-int8" if quantized else "") + ("-sdpa" if sdpa else "")
+    if label_index is not None:
+        variant += f"-labels{label_index.digest}"
+    torch_version = torch.__version__.split('+')[0]
+    return f"{stem}.{variant}.torch{torch_version}.torchscript.pth"
+
+
+def export_torchscript(model, example_inputs, path):
+    """Trace `model` on `example_inputs`, freeze it and save it to `path`; returns the frozen module.
+
+    Tracing unrolls the Python-level token/list handling of the MHSA blocks at the traced
+    image size, and freezing folds parameters into the graph as constants.
+    """
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example_inputs, check_trace=False)
+        frozen = torch.jit.freeze(traced)
+    # Write next to the destination and rename so a crash never leaves a truncated file behind
+    tmp = f"{path}.tmp"
+    torch.jit.save(frozen, tmp)
+    os.replace(tmp, path)
+    return frozen
+
+
+def export_onnx(model, example_inputs, path, opset_version=17):
+    """Export `model` to ONNX at the example image size, with a dynamic batch dimension.
+
+    The graph takes `image` (B, 3, S, S, ImageNet-normalised) and returns `logits` (B, num_classes);
+    it is what `onnx_backend.OnnxInference` runs.
+    """
+    kwargs = dict(input_names=['image'], output_names=['logits'],
+                  dynamic_axes={'image': {0: 'batch'}, 'logits': {0: 'batch'}},
+                  opset_version=opset_version, do_constant_folding=True)
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # Newer PyTorch defaults to the dynamo exporter; the TorchScript one handles dynamic_axes everywhere
+        kwargs['dynamo'] = False
+    tmp = f"{path}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(model, example_inputs, tmp, **kwargs)
+    os.replace(tmp, path)
+    return path
+
+
+def cache_attention_bias(model):
+    """Gather every attention block's relative position bias once and reuse it on later calls.
+
+    Costs one (heads, N, N) tensor per block (about 150MB for MetaFG_2 at 384px).
+    """
+    with torch.no_grad():
+        for module in model.modules():
+            if isinstance(module, Relative_Attention):
+                module.cache_bias = True
+                module.relative_position_bias()
+
+
+def share_model_memory(model):
+    """`model.share_memory()` for forked workers, with the cached attention biases shared as well.
+
+    Moving the bias tables changes their `data_ptr`, which invalidates biases cached before;
+    they are gathered again from the shared tables and moved to shared memory too.
+    """
+    model.share_memory()
+    with torch.no_grad():
+        for module in model.modules():
+            if isinstance(module, Relative_Attention) and module.cache_bias:
+                # Drop the stale copy first so the old and new caches are never held together
+                module._bias_cache, module._bias_cache_key = None, None
+                module.relative_position_bias().share_memory_()
+
+
+def use_sdpa_attention(model):
+    """Switch every attention block to `F.scaled_dot_product_attention` (PyTorch 2.0+).
+
+    The relative position bias is passed as an additive mask, so the fused kernels can skip
+    materialising the full (B, heads, N, N) attention matrix. Check with check_parity.py.
+    """
+    if not hasattr(torch.nn.functional, 'scaled_dot_product_attention'):
+        raise RuntimeError(f'scaled_dot_product_attention needs PyTorch 2.0+, found {torch.__version__}')
+    for module in model.modules():
+        if isinstance(module, Relative_Attention):
+            module.use_sdpa = True
+
+
+def slice_head(model, class_indices):
+    """Keep only the classifier rows of `class_indices`: logit j becomes the logit of class `class_indices[j]`.
+
+    Softmax then runs over the kept classes only, and the head shrinks accordingly.
+    """
+    head = model.head
+    index = torch.as_tensor(class_indices, dtype=torch.long, device=head.weight.device)
+    sliced = torch.nn.Linear(head.in_features, len(class_indices), bias=head.bias is not None)
+    sliced.weight = torch.nn.Parameter(head.weight.detach().index_select(0, index), requires_grad=False)
+    if head.bias is not None:
+        sliced.bias = torch.nn.Parameter(head.bias.detach().index_select(0, index), requires_grad=False)
+    model.head = sliced
+    model.num_classes = len(class_indices)
+
+
+def uses_text_meta(config):
+    """True when the config expects BERT word embeddings as meta tokens."""
+    return bool(config.DATA.ADD_META) and BERT_META_DIM in list(config.MODEL.META_DIMS)
+
+
 class GenerateEmbedding:
     def __init__(self):
+        # Imported here so image-only models never pay for loading transformers
+        from transformers import AutoTokenizer, AutoModel
         self.tokenizer = AutoTokenizer.from_pretrained("bert-base-uncased")
         self.model = AutoModel.from_pretrained("bert-base-uncased")
 
@@ -81,67 +278,229 @@ class GenerateEmbedding:
 
 
 class Inference:
-    def __init__(self, config_path, model_path, names_path):
+    def __init__(self, config_path, model_path, names_path, quantize=False, torchscript=False,
+                 cache_bias=True, sdpa=False, fuse=True, img_size=None, early_exit_threshold=None,
+                 label_index=None, draft_decode=True):
 
         self.config_path = config_path
         self.model_path = model_path
-        self.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        self.quantized = quantize
+        # Quantized kernels are CPU-only
+        self.device = torch.device("cuda:0" if torch.cuda.is_available() and not quantize else "cpu")
         self.classes = read_class_names(names_path)
+        # With a label index (build_label_index.py) the head only computes our taxonomy's classes,
+        # and `classes`/`class_taxa` follow the sliced head's order
+        self.label_index = LabelIndex(label_index, self.classes) if label_index else None
+        if self.label_index is not None:
+            self.classes = tuple(self.classes[idx] for idx in self.label_index.classes)
+            self.class_taxa = self.label_index.class_taxa
+        else:
+            self.class_taxa = None
 
         self.config = model_config(self.config_path)
-
-        self.model = build_model(self.config)
-        # PyTorch 2.6+ defaults weights_only=True; allow loading full checkpoint from trusted source
-        self.checkpoint = torch.load(self.model_path, map_location='cpu', weights_only=False)
-
-        if 'model' in self.checkpoint:
-            self.model.load_state_dict(self.checkpoint['model'], strict=False)
-        else:
-            self.model.load_state_dict(self.checkpoint, strict=False)
-            
-        self.model.eval()
-        self.model.to(self.device)
+        if img_size is not None and img_size != self.config.DATA.IMG_SIZE:
+            # Run at another resolution than trained: the relative position bias tables are
+            # resampled to the new token grid when the weights load (see build_eager_model)
+            if img_size % 32:
+                raise ValueError(f'img_size must be a multiple of 32 (stage_4 runs at 1/32), got {img_size}')
+            self.config.defrost()
+            self.config.DATA.IMG_SIZE = img_size
+            self.config.freeze()
+        self.img_size = self.config.DATA.IMG_SIZE
         self.topk = 10
-        self.embedding_gen = GenerateEmbedding()
+        # Decode large JPEGs at a reduced DCT scale that still covers img_size
+        self.draft_decode = draft_decode
+        # bert-base-uncased is only needed by MetaFG_meta_bert configs; build it on first use
+        self.needs_text_meta = uses_text_meta(self.config)
+        self._embedding_gen = None
+
+        self.torchscript_path = None
+        if torchscript:
+            self.torchscript_path = torchscript_cache_path(self.model_path, self.img_size, quantize, sdpa,
+                                                          self.label_index)
+            cached = os.path.exists(self.torchscript_path) and \
+                os.path.getmtime(self.torchscript_path) >= os.path.getmtime(self.model_path)
+        if torchscript and cached:
+            # The frozen graph carries its own weights: no eager model to build or checkpoint to load
+            self.model = torch.jit.load(self.torchscript_path, map_location=self.device)
+            self.weights_mmapped = False
+        else:
+            # A traced graph folds the bias into constants itself
+            self.model = self.build_eager_model(quantize, cache_bias=cache_bias and not torchscript, sdpa=sdpa,
+                                                fuse=fuse)
+            if torchscript:
+                self.model = export_torchscript(self.model, self.example_inputs(), self.torchscript_path)
+                # Its weights now live in the frozen graph's constants, not the mmap'd checkpoint
+                self.weights_mmapped = False
+
+        # Images whose stage_3 (cls_1) prediction is at least this confident skip stage_4;
+        # pick the value with calibrate_early_exit.py
+        self.early_exit_threshold = early_exit_threshold
+        if early_exit_threshold is not None:
+            if torchscript or not hasattr(self.model, 'forward_early_exit') or self.config.MODEL.ONLY_LAST_CLS \
+                    or self.needs_text_meta:
+                raise ValueError('early exit needs an eager, image-only MetaFG with ONLY_LAST_CLS=False')
+        self.images_seen = 0
+        self.early_exits = 0
 
         self.transform_img = transforms.Compose([
-            transforms.Resize((self.config.DATA.IMG_SIZE, self.config.DATA.IMG_SIZE), interpolation=Image.BILINEAR),
+            transforms.Resize((self.img_size, self.img_size), interpolation=Image.BILINEAR),
             transforms.ToTensor(), # transforms.Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5])
             transforms.Normalize(IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD)
         ])
 
-    def infer(self, img_path, meta_data_path, topk=None):
-
-        if isinstance(img_path, str):
-            if img_path.startswith("http"):
-                img = Image.open(requests.get(img_path, stream=True).raw).convert('RGB')
-            else:
-                img = Image.open(img_path).convert('RGB')
-        else:
-            img = img_path
-        
-        """
-        _, _, meta = self.embedding_gen(meta_data_path)
-        meta = meta.to(self.device)
+    def build_eager_model(self, quantize=False, cache_bias=False, sdpa=False, fuse=False):
+        model = build_model(self.config)
+        state_dict, self.weights_mmapped = load_weights(self.model_path)
+        # Bicubic-resamples every relative_position_bias_table that doesn't match img_size, and drops
+        # the checkpoint's relative_position_index buffers in favour of the ones built for img_size
+        state_dict = relative_bias_interpolate({'model': state_dict}, self.config)['model']
+        try:
+            # assign=True makes the loaded (possibly mmap'd) tensors the parameters instead of
+            # copying them into the freshly initialised ones, so weights are never held twice
+            model.load_state_dict(state_dict, strict=False, assign=True)
+        except TypeError:
+            # PyTorch < 2.1 has no assign
+            model.load_state_dict(state_dict, strict=False)
+        del state_dict
+
+        model.eval()
+        model.to(self.device)
+        if fuse:
+            # Conv+BatchNorm folding in the stem and MBConv stages
+            model.fuse_for_inference()
+        if cache_bias:
+            cache_attention_bias(model)
+        if sdpa:
+            use_sdpa_attention(model)
+        if self.label_index is not None:
+            slice_head(model, self.label_index.classes)
+        if quantize:
+            quantize_dynamic_int8(model)
+        return model
+
+    def example_inputs(self, batch_size=1):
+        """Blank model inputs at the configured IMG_SIZE (meta tokens included when the model takes them)."""
+        size = self.img_size
+        batch = torch.zeros(batch_size, 3, size, size, device=self.device)
+        meta = self.text_meta(os.path.join(os.path.dirname(__file__), 'meta.txt'), batch_size=batch_size)
+        return (batch,) if meta is None else (batch, meta)
+
+    def forward(self, batch, meta=None):
+        # Traced modules only take tensors, so leave meta out when there is none
+        return self.model(batch) if meta is None else self.model(batch, meta)
+
+    def logits(self, batch, meta=None):
+        """Class logits for a preprocessed batch, exiting after stage_3 where confident enough."""
+        self.images_seen += batch.shape[0]
+        if self.early_exit_threshold is None:
+            return self.forward(batch, meta)
+        logits, exited = self.model.forward_early_exit(batch, self.early_exit_threshold)
+        self.early_exits += int(exited.sum())
+        return logits
+
+    def early_exit_stats(self):
+        return {
+            'threshold': self.early_exit_threshold,
+            'images': self.images_seen,
+            'early_exits': self.early_exits,
+            'exit_rate': round(self.early_exits / self.images_seen, 4) if self.images_seen else 0.0,
+        }
+
+    def warmup(self, batch_size=1):
+        """Run one forward pass on a blank batch at the configured IMG_SIZE to prime kernels and allocator caches."""
+        with torch.no_grad():
+            self.forward(*self.example_inputs(batch_size))
+
+    @property
+    def embedding_gen(self):
+        if self._embedding_gen is None:
+            self._embedding_gen = GenerateEmbedding()
+        return self._embedding_gen
+
+    def text_meta(self, meta_data_path, batch_size=1):
+        """BERT meta tokens for models that need them, None for image-only models."""
+        if not self.needs_text_meta:
+            return None
+        if meta_data_path is None:
+            raise ValueError(f'{self.config.MODEL.NAME} needs text meta data; pass meta_data_path')
+        with torch.no_grad():
+            _, _, meta = self.embedding_gen.generate(meta_data_path)
+        return meta.to(self.device).expand(batch_size, -1, -1)
+
+    def topk_predictions(self, y_pred, topk=None):
+        """Top-k of a (B, num_classes) probability tensor as one TopK of numpy arrays per row.
+
+        A single `torch.topk` over the batch and one bulk device -> host copy per tensor;
+        `topk=None` keeps every class.
         """
-        meta = None
-
-        img = self.transform_img(img)
-        img.unsqueeze_(0)
-        img = img.to(self.device)
-        img = Variable(img).to(self.device)
-        out = self.model(img, meta)
-
-        f = torch.nn.Softmax(dim=1)
-        y_pred = f(out)
-        # Convert to a list so we can slice reliably
-        indices = torch.argsort(y_pred, dim=1, descending=True).squeeze().tolist()
-
+        k = y_pred.shape[1] if topk is None else min(topk, y_pred.shape[1])
+        scores, indices = torch.topk(y_pred, k, dim=1)
+        indices = indices.cpu().numpy()
+        scores = scores.float().cpu().numpy()
+        return [TopK(row_indices, row_scores) for row_indices, row_scores in zip(indices, scores)]
+
+    def label_scores(self, pred):
+        """Expand a compact TopK into an ordered `{label: score}` dict."""
+        return {self.classes[idx]: score for idx, score in zip(pred.indices.tolist(), pred.scores.tolist())}
+
+    def preprocess(self, images):
+        """Normalized (B, 3, S, S) model input on the model's device, resized and normalized as whole-batch
+        tensor ops (see preprocess.py); same result as stacking `transform_img` outputs up to rounding."""
+        min_size = self.img_size if self.draft_decode else None
+        return preprocess_batch([load_image_tensor(img, min_size) for img in images], self.img_size,
+                                IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD, self.device)
+
+    def infer(self, img_path, meta_data_path, topk=None, compact=False):
+
+        img = self.preprocess([img_path])
+        meta = self.text_meta(meta_data_path)
+
+        with torch.no_grad():
+            out = self.logits(img, meta)
+            y_pred = torch.softmax(out, dim=1)
+        pred = self.topk_predictions(y_pred, topk)[0]
+
+        if compact:
+            return pred
         if topk is not None:
-            predict = [{self.classes[idx]: y_pred.squeeze()[idx].cpu().item() for idx in indices[:topk]}]
-            return predict
+            return [self.label_scores(pred)]
         else:
-            return {self.classes[idx]: y_pred.squeeze()[idx].cpu().item() for idx in indices}
+            return self.label_scores(pred)
+
+    def infer_batch(self, images, topk=None, meta_data_path=None, compact=False, timings=None):
+        """Classify a list of images in one forward pass.
+
+        `images` may mix RGB uint8 (3, H, W) tensors (`preprocess.decode_to_tensor`), PIL images,
+        raw bytes, file-like objects, paths and URLs.
+        Returns one `{label: score}` dict per image, ordered by descending score and
+        holding the top `topk` classes (all classes when `topk` is None). With
+        `compact=True` each entry is a TopK of parallel label-index / float32 score arrays.
+        `meta_data_path` is only read by models that take text meta tokens.
+        A `timings` dict receives the preprocess, forward and postprocess seconds of the batch.
+        """
+        if len(images) == 0:
+            return []
+
+        start = time.perf_counter()
+        batch = self.preprocess(images)
+        preprocessed = time.perf_counter()
+        with torch.no_grad():
+            meta = self.text_meta(meta_data_path, batch_size=batch.shape[0])
+            logits = self.logits(batch, meta)
+            if timings is not None and logits.is_cuda:
+                # Kernels run asynchronously; without this the forward pass is billed to topk's copy
+                torch.cuda.synchronize(logits.device)
+            forwarded = time.perf_counter()
+            y_pred = torch.softmax(logits, dim=1)
+
+        preds = self.topk_predictions(y_pred, topk)
+        if not compact:
+            preds = [self.label_scores(pred) for pred in preds]
+        if timings is not None:
+            timings.update(preprocess=preprocessed - start, forward=forwarded - preprocessed,
+                           postprocess=time.perf_counter() - forwarded)
+        return preds
 
 
 def parse_option():
@@ -153,6 +512,15 @@ def parse_option():
     parser.add_argument('--img-folder', type=str, help='path to image')
     parser.add_argument('--meta-path', default="meta.txt", type=str, help='path to meta data')
     parser.add_argument('--names-path', default="names_mf2.txt", type=str, help='path to meta data')
+    parser.add_argument('--batch-size', default=16, type=int, help='number of images per forward pass')
+    parser.add_argument('--quantize', action='store_true', help='run with int8 dynamically quantized Linear layers (CPU)')
+    parser.add_argument('--early-exit', type=float, help='confidence threshold for skipping stage_4 (see calibrate_early_exit.py)')
+    parser.add_argument('--img-size', type=int, help='run at this resolution instead of the config DATA.IMG_SIZE')
+    parser.add_argument('--no-fuse', action='store_true', help='keep BatchNorm layers separate from their convolutions')
+    parser.add_argument('--sdpa', action='store_true', help='use scaled_dot_product_attention in the MHSA blocks')
+    parser.add_argument('--label-index', type=str, help='only score the classes of this label index (build_label_index.py)')
+    parser.add_argument('--torchscript', action='store_true', help='run a frozen TorchScript export (cached next to the model)')
+    parser.add_argument('--no-draft-decode', action='store_true', help='decode large JPEGs at full size (JPEG_DRAFT_DECODE=0)')
     args = parser.parse_args()
     return args
 
@@ -161,44 +529,67 @@ if __name__ == '__main__':
     args = parse_option()
     model = Inference(config_path=args.cfg,
                        model_path=args.model_path,
-                       names_path=args.names_path)
+                       names_path=args.names_path,
+                       quantize=args.quantize,
+                       torchscript=args.torchscript,
+                       sdpa=args.sdpa,
+                       fuse=not args.no_fuse,
+                       img_size=args.img_size,
+                       early_exit_threshold=args.early_exit,
+                       label_index=args.label_index,
+                       draft_decode=not args.no_draft_decode)
     
     from glob import glob
     glob_imgs = glob(os.path.join(args.img_folder, "*.jpg"))
     out_dir = f"results_{os.path.splitext(os.path.basename(args.model_path))[0]}"
     os.makedirs(out_dir, exist_ok=True)
 
-    for img in tqdm(glob_imgs):
+    # Same draft-decode size as Inference.preprocess and the service; a loaded PIL image can't be drafted later
+    min_size = model.img_size if model.draft_decode else None
+
+    def load_batch(paths):
+        # Decode individually so one unreadable file doesn't sink the whole batch
+        loaded = []
+        for path in paths:
+            try:
+                loaded.append((path, load_image(path, min_size)))
+            except Exception as e:
+                print(e)
+        return loaded
+
+    for start in tqdm(range(0, len(glob_imgs), args.batch_size)):
         try:
-            res = model.infer(img_path=img, meta_data_path=args.meta_path)
+            loaded = load_batch(glob_imgs[start:start + args.batch_size])
+            preds = model.infer_batch([im for _, im in loaded], meta_data_path=args.meta_path)
         except KeyboardInterrupt:
             break
         except Exception as e:
             print(e)
             continue
-        
-        out = {}
-        out['preds'] = res
 
-        """
-        # Out is a list of (class, score). Return true/false if the top1 class is correct
-        out['top1_correct'] = '_'.join(res[0][1].split(' ')).lower() in os.path.basename(img).lower()
-
-        out['top5_correct'] = False
-        print(os.path.basename(img).lower())
-        for i in range(5):
-            out['top5_correct'] |= '_'.join(res[i][1].split(' ')).lower() in os.path.basename(img).lower()
-            print('_'.join(res[i][1].split(' ')).lower())
-            
-        out['top10_correct'] = False
-        for i in range(10):
-            out['top10_correct'] |= '_'.join(res[i][1].split(' ')).lower() in os.path.basename(img).lower()
-        """
+        for (img, _), res in zip(loaded, preds):
+            out = {}
+            out['preds'] = res
+
+            """
+            # Out is a list of (class, score). Return true/false if the top1 class is correct
+            out['top1_correct'] = '_'.join(res[0][1].split(' ')).lower() in os.path.basename(img).lower()
 
-        # output json with inference results, use image basename 
-        # as filename
-        import json
-        with open(os.path.join(out_dir, os.path.splitext(os.path.basename(img))[0]+".json"), 'w') as fp:
-            json.dump(out, fp, indent=1)
+            out['top5_correct'] = False
+            print(os.path.basename(img).lower())
+            for i in range(5):
+                out['top5_correct'] |= '_'.join(res[i][1].split(' ')).lower() in os.path.basename(img).lower()
+                print('_'.join(res[i][1].split(' ')).lower())
+            
+            out['top10_correct'] = False
+            for i in range(10):
+                out['top10_correct'] |= '_'.join(res[i][1].split(' ')).lower() in os.path.basename(img).lower()
+            """
+
+            # output json with inference results, use image basename 
+            # as filename
+            import json
+            with open(os.path.join(out_dir, os.path.splitext(os.path.basename(img))[0]+".json"), 'w') as fp:
+                json.dump(out, fp, indent=1)
 
 # Usage: python inference.py --cfg 'path/to/cfg' --model_path 'path/to/model' --img-path 'path/to/img' --meta-path 'path/to/meta'
\ No newline at end of file
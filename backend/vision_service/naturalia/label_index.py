@@ -0,0 +1,104 @@
+"""
+Mapping from our taxonomy (data/lepidoptera, data/plant) to the iNat classes of the model.
+
+`build_label_index.py` writes it once as JSON; at serve time it selects the classifier rows
+worth computing and tells which of our taxa each selected class stands for. Only the
+standard library is used, so both inference backends can load it.
+
+A taxon is identified as `<source>:<scientific name>` (e.g. `lepidoptera:Badamia
+exclamationis`); the CSVs carry no other stable key.
+"""
+import csv
+import hashlib
+import json
+from collections import OrderedDict, defaultdict, namedtuple
+
+# What a selected class maps to: `match` is 'species' when the class is one of our taxa,
+# 'genus' when it only shares the genus of taxa the model has no class for
+ClassTaxa = namedtuple('ClassTaxa', ['match', 'taxon_ids'])
+
+
+def normalise_name(name):
+    return ' '.join(name.replace('_', ' ').split()).lower()
+
+
+def class_names_digest(class_names):
+    """Fingerprint of the model's class list; an index only applies to the list it was built for."""
+    return hashlib.sha1('\n'.join(class_names).encode('utf-8')).hexdigest()
+
+
+def read_taxa(csv_path, source):
+    """(taxon_id, genus, scientific_name) for every row of a taxonomy CSV, first occurrence wins."""
+    taxa = OrderedDict()
+    with open(csv_path, newline='', encoding='utf-8-sig') as fp:
+        for row in csv.DictReader(fp):
+            name = ' '.join((row.get('scientific_name') or '').split())
+            if not name:
+                continue
+            taxon_id = f'{source}:{name}'
+            if taxon_id not in taxa:
+                genus = (row.get('genus') or name.split(' ')[0]).strip()
+                taxa[taxon_id] = (genus, name)
+    return [(taxon_id, genus, name) for taxon_id, (genus, name) in taxa.items()]
+
+
+def build_label_index(class_names, sources):
+    """Match the rows of each `{source: csv_path}` against `class_names`.
+
+    A row maps to the class with its scientific name, else to the class of its binomial
+    (subspecies dropped), else to every class of its genus. Rows with none are left unmatched.
+    """
+    by_name = {normalise_name(name): idx for idx, name in enumerate(class_names)}
+    by_genus = defaultdict(list)
+    for idx, name in enumerate(class_names):
+        by_genus[normalise_name(name).split(' ')[0]].append(idx)
+
+    taxa = OrderedDict()
+    unmatched = {}
+    for source, csv_path in sources.items():
+        missing = 0
+        for taxon_id, genus, name in read_taxa(csv_path, source):
+            key = normalise_name(name)
+            idx = by_name.get(key, by_name.get(' '.join(key.split(' ')[:2])))
+            if idx is not None:
+                taxa[taxon_id] = {'match': 'species', 'classes': [idx]}
+            elif by_genus.get(normalise_name(genus)):
+                taxa[taxon_id] = {'match': 'genus', 'classes': by_genus[normalise_name(genus)]}
+            else:
+                missing += 1
+        unmatched[source] = missing
+
+    return {
+        'num_classes': len(class_names),
+        'class_names_sha1': class_names_digest(class_names),
+        'classes': sorted({idx for entry in taxa.values() for idx in entry['classes']}),
+        'taxa': taxa,
+        'unmatched': unmatched,
+    }
+
+
+def save_label_index(index, path):
+    with open(path, 'w', encoding='utf-8') as fp:
+        json.dump(index, fp, ensure_ascii=False, separators=(',', ':'))
+
+
+class LabelIndex:
+    """A built index checked against the model's class list.
+
+    `classes` are the selected model class indices (ascending), `class_taxa[i]` the ClassTaxa
+    of `classes[i]`: the taxa matched on species, or only the genus-level ones when there are none.
+    """
+    def __init__(self, path, class_names):
+        with open(path, encoding='utf-8') as fp:
+            index = json.load(fp)
+        if index['num_classes'] != len(class_names) or index['class_names_sha1'] != class_names_digest(class_names):
+            raise ValueError(f'{path} was built for another class list; rebuild it with build_label_index.py')
+        self.path = path
+        self.classes = index['classes']
+        species, genus = defaultdict(list), defaultdict(list)
+        for taxon_id, entry in index['taxa'].items():
+            for idx in entry['classes']:
+                (species if entry['match'] == 'species' else genus)[idx].append(taxon_id)
+        self.class_taxa = [ClassTaxa('species', species[idx]) if species[idx] else ClassTaxa('genus', genus[idx])
+                           for idx in self.classes]
+        self.digest = hashlib.sha1(','.join(map(str, self.classes)).encode('ascii')).hexdigest()[:8]
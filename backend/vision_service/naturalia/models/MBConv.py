@@ -4,6 +4,7 @@ from functools import partial
 import torch
 from torch import nn
 from torch.nn import functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 class SwishImplementation(torch.autograd.Function):
     @staticmethod
@@ -20,7 +21,11 @@ class SwishImplementation(torch.autograd.Function):
 
 class MemoryEfficientSwish(nn.Module):
     def forward(self, x):
-        return SwishImplementation.apply(x)
+        # The custom autograd function only pays off when backpropagating, and a traced
+        # (TorchScript) graph cannot contain it, so inference uses the fused SiLU kernel
+        if x.requires_grad and torch.is_grad_enabled():
+            return SwishImplementation.apply(x)
+        return F.silu(x)
 
 
 def drop_connect(inputs, p, training):
@@ -161,6 +166,21 @@ class MBConvBlock(nn.Module):
                 x = drop_connect(x, p=self._drop_connect_rate, training=self.training)
             x = x + inputs  # skip connection
         return x
+
+    def fuse_for_inference(self):
+        """
+        Fold _bn0/_bn1/_bn2 into the convolution before each of them and swap the swish
+        autograd Function for nn.SiLU. Eval mode only: the folded weights bake in the running stats.
+        """
+        if self._expand_ratio != 1:
+            self._expand_conv = fuse_conv_bn_eval(self._expand_conv, self._bn0)
+            self._bn0 = nn.Identity()
+        self._depthwise_conv = fuse_conv_bn_eval(self._depthwise_conv, self._bn1)
+        self._bn1 = nn.Identity()
+        self._project_conv = fuse_conv_bn_eval(self._project_conv, self._bn2)
+        self._bn2 = nn.Identity()
+        self._swish = nn.SiLU()
+        return self
 if __name__ == '__main__':
     input=torch.randn(1,3,112,112)
     mbconv=MBConvBlock(ksize=3,input_filters=3,output_filters=3,expand_ratio=4,stride=1)
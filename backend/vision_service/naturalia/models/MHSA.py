@@ -66,6 +66,33 @@ class Relative_Attention(nn.Module):
         self.proj_drop = nn.Dropout(proj_drop)
         trunc_normal_(self.relative_position_bias_table, std=.02)
         self.softmax = nn.Softmax(dim=-1)
+        # Compute attention with F.scaled_dot_product_attention (bias as additive mask); off by default
+        self.use_sdpa = False
+        # Inference-only reuse of the gathered bias, see relative_position_bias(); off by default
+        self.cache_bias = False
+        self._bias_cache = None
+        self._bias_cache_key = None
+    def _gather_relative_position_bias(self):
+        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
+            self.img_size[0] * self.img_size[1] + self.extra_token_num, self.img_size[0] * self.img_size[1] + self.extra_token_num, -1)  # h*w+1,h*w+1,nH
+        return relative_position_bias.permute(2, 0, 1).contiguous()  # nH, h*w+1, h*w+1
+    def relative_position_bias(self):
+        """
+        Relative position bias (nH, h*w+1, h*w+1) added to the attention logits.
+        With `cache_bias` set and neither training nor autograd active, the gathered bias is
+        kept and reused until the table or index changes (in place, replaced or moved).
+        Traced graphs always gather, so exports carry the table rather than a stale copy.
+        """
+        table = self.relative_position_bias_table
+        if not self.cache_bias or self.training or torch.jit.is_tracing() or \
+                (torch.is_grad_enabled() and table.requires_grad):
+            return self._gather_relative_position_bias()
+        key = (table._version, table.data_ptr(), table.device, table.dtype,
+               self.relative_position_index._version, self.relative_position_index.data_ptr())
+        if self._bias_cache_key != key:
+            self._bias_cache = self._gather_relative_position_bias()
+            self._bias_cache_key = key
+        return self._bias_cache
     def forward(self, x,):
         """
         Args:
@@ -75,14 +102,21 @@ class Relative_Attention(nn.Module):
         qkv = self.qkv(x).reshape(B_, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         q, k, v = qkv[0], qkv[1], qkv[2]  # make torchscript happy (cannot use tensor as tuple)
 
+        if self.use_sdpa:
+            # SDPA scales by 1/sqrt(head_dim) itself; fold in the difference to self.scale (qk_scale)
+            q = q * (self.scale * q.shape[-1] ** 0.5)
+            bias = self.relative_position_bias().unsqueeze(0).to(q.dtype)
+            x = F.scaled_dot_product_attention(q, k, v, attn_mask=bias,
+                                               dropout_p=self.attn_drop.p if self.training else 0.)
+            x = x.transpose(1, 2).reshape(B_, N, C)
+            x = self.proj(x)
+            x = self.proj_drop(x)
+            return x
+
         q = q * self.scale
         attn = (q @ k.transpose(-2, -1))
 
-        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
-            self.img_size[0] * self.img_size[1] + self.extra_token_num, self.img_size[0] * self.img_size[1] + self.extra_token_num, -1)  # h*w+1,h*w+1,nH
-        
-        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, h*w+1, h*w+1
-        attn = attn + relative_position_bias.unsqueeze(0)
+        attn = attn + self.relative_position_bias().unsqueeze(0)
 
         attn = self.softmax(attn)
         
@@ -1,6 +1,7 @@
 import math
 import torch
 import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 from timm.models.helpers import load_pretrained
 from timm.models.registry import register_model
@@ -135,9 +136,29 @@ class MetaFG(nn.Module):
         self.num_classes = num_classes
         self.head = nn.Linear(self.embed_dim, num_classes) if num_classes > 0 else nn.Identity()
 
+    def fuse_for_inference(self):
+        """
+        Fold every BatchNorm into the convolution before it (stem and MBConv blocks) and use
+        nn.SiLU instead of the swish autograd Function. Call after loading weights, in eval mode.
+        """
+        assert not self.training, 'fuse_for_inference() needs eval mode'
+        self.stage_0[0] = fuse_conv_bn_eval(self.stage_0[0], self.stage_0[1])
+        self.stage_0[1] = nn.Identity()
+        self.stage_0[3] = fuse_conv_bn_eval(self.stage_0[3], self.stage_0[4])
+        self.stage_0[4] = nn.Identity()
+        self.stage_0[6] = fuse_conv_bn_eval(self.stage_0[6], self.bn1)
+        self.bn1 = nn.Identity()
+        for blk in list(self.stage_1) + list(self.stage_2):
+            blk.fuse_for_inference()
+        return self
+
     def forward_features(self,x,meta=None):
+        x,cls_1 = self.forward_to_stage_3(x)
+        return self.forward_stage_4(x,cls_1)
+
+    def forward_to_stage_3(self,x):
+        """Stem and stages 1-3: (stage_3 patch tokens, projected cls_1 or None)."""
         extra_tokens_1 = [self.cls_token_1]
-        extra_tokens_2 = [self.cls_token_2]
         B = x.shape[0]
         x = self.stage_0(x)
         x = self.bn1(x)
@@ -157,7 +178,14 @@ class MetaFG(nn.Module):
             cls_1 = x[:, :1, :]
             cls_1 = self.norm_1(cls_1)
             cls_1 = self.cl_1_fc(cls_1)
-        x = x[:, 1:, :]
+        else:
+            cls_1 = None
+        return x[:, 1:, :],cls_1
+
+    def forward_stage_4(self,x,cls_1):
+        """Stage 4 and the cls aggregation, from the outputs of forward_to_stage_3."""
+        extra_tokens_2 = [self.cls_token_2]
+        B = x.shape[0]
         H1,W1 = self.img_size//16,self.img_size//16
         x = x.reshape(B,H1,W1,-1).permute(0, 3, 1, 2).contiguous()
         for ind,blk in enumerate(self.stage_4):
@@ -179,6 +207,35 @@ class MetaFG(nn.Module):
         x = self.forward_features(x,meta)
         x = self.head(x)
         return x 
+
+    def early_exit_logits(self,cls_1):
+        """
+        Classify from cls_1 alone with the trained aggregate/norm/head: the aggregation
+        runs with cls_2 zeroed, so no extra weights are needed.
+        """
+        cls = torch.cat((cls_1,torch.zeros_like(cls_1)), dim=1)#B,2,C
+        cls = self.aggregate(cls).squeeze(dim=1)#B,C
+        return self.head(self.norm(cls))
+
+    def forward_early_exit(self,x,threshold):
+        """
+        Logits for x plus a bool mask of the rows that exited after stage_3: those whose
+        early-exit softmax confidence reaches `threshold` skip stage_4; the rest run the full model.
+        """
+        assert not self.only_last_cls, 'early exit needs the stage_3 cls token (ONLY_LAST_CLS=False)'
+        x,cls_1 = self.forward_to_stage_3(x)
+        logits = self.early_exit_logits(cls_1)
+        exited = torch.softmax(logits, dim=1).max(dim=1).values >= threshold
+        if not bool(exited.all()):
+            rest = ~exited
+            logits = logits.clone()
+            logits[rest] = self.head(self.forward_stage_4(x[rest],cls_1[rest]))
+        return logits,exited
+
+    def forward_both_heads(self,x):
+        """(early-exit logits, full-model logits) for every row; used to calibrate the threshold."""
+        x,cls_1 = self.forward_to_stage_3(x)
+        return self.early_exit_logits(cls_1),self.head(self.forward_stage_4(x,cls_1))
 @register_model
 def MetaFG_0(pretrained=False, **kwargs):
     model = MetaFG(conv_embed_dims = [64,96,192],attn_embed_dims=[384,768],
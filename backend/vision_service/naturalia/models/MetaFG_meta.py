@@ -1,6 +1,7 @@
 import math
 import torch
 import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 import torch.utils.checkpoint as checkpoint
 from timm.models.helpers import load_pretrained
 from timm.models.registry import register_model
@@ -161,6 +162,22 @@ class MetaFG_Meta(nn.Module):
         self.num_classes = num_classes
         self.head = nn.Linear(self.embed_dim, num_classes) if num_classes > 0 else nn.Identity()
 
+    def fuse_for_inference(self):
+        """
+        Fold every BatchNorm into the convolution before it (stem and MBConv blocks) and use
+        nn.SiLU instead of the swish autograd Function. Call after loading weights, in eval mode.
+        """
+        assert not self.training, 'fuse_for_inference() needs eval mode'
+        self.stage_0[0] = fuse_conv_bn_eval(self.stage_0[0], self.stage_0[1])
+        self.stage_0[1] = nn.Identity()
+        self.stage_0[3] = fuse_conv_bn_eval(self.stage_0[3], self.stage_0[4])
+        self.stage_0[4] = nn.Identity()
+        self.stage_0[6] = fuse_conv_bn_eval(self.stage_0[6], self.bn1)
+        self.bn1 = nn.Identity()
+        for blk in list(self.stage_1) + list(self.stage_2):
+            blk.fuse_for_inference()
+        return self
+
     def forward_features(self,x,meta=None):
         B = x.shape[0]
         extra_tokens_1 = [self.cls_token_1]
@@ -0,0 +1,127 @@
+"""
+ONNX Runtime backend for MetaFG inference.
+
+Runs a graph written by `export_onnx.py` with onnxruntime on CPU. Only numpy, PIL and
+onnxruntime are imported, so a service running this backend needs neither torch, timm
+nor transformers. `OnnxInference` mirrors the parts of `inference.Inference` the vision
+service uses (`infer_batch`, `warmup`, `classes`, `class_taxa`, `img_size`).
+"""
+import time
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+from label_index import LabelIndex
+
+IMAGENET_DEFAULT_MEAN = np.array((0.485, 0.456, 0.406), dtype=np.float32)
+IMAGENET_DEFAULT_STD = np.array((0.229, 0.224, 0.225), dtype=np.float32)
+# Same layout as inference.TopK: parallel arrays of class indices and scores, best first
+TopK = namedtuple('TopK', ['indices', 'scores'])
+
+
+def read_class_names(file_path):
+    with open(file_path, 'r') as fp:
+        return tuple(line.strip() for line in fp)
+
+
+class OnnxInference:
+    def __init__(self, onnx_path, names_path, intra_op_threads=0, inter_op_threads=0, label_index=None):
+        """`intra_op_threads`/`inter_op_threads` of 0 leave the onnxruntime defaults."""
+        import onnxruntime as ort
+
+        self.model_path = onnx_path
+        self.classes = read_class_names(names_path)
+        self.label_index = LabelIndex(label_index, self.classes) if label_index else None
+        self.class_taxa = None
+        self.weights_mmapped = False
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+
+        image_input = self.session.get_inputs()[0]
+        self.input_name = image_input.name
+        # The graph is exported at a fixed square size with a dynamic batch dimension
+        self.img_size = int(image_input.shape[2])
+
+        # A graph exported with `export_onnx.py --label-index` already has the sliced head;
+        # for a full graph the index's columns are picked from its logits
+        self.logit_columns = None
+        num_outputs = self.session.get_outputs()[0].shape[1]
+        if not isinstance(num_outputs, int):
+            # Symbolic class dimension: read it off one blank image
+            blank = np.zeros((1, 3, self.img_size, self.img_size), dtype=np.float32)
+            num_outputs = self.session.run(None, {self.input_name: blank})[0].shape[1]
+        expected = {len(self.classes)}
+        if self.label_index is not None:
+            expected.add(len(self.label_index.classes))
+        if num_outputs not in expected:
+            # Most likely a graph exported with another (or no) --label-index under the same file name
+            raise ValueError(f'{onnx_path} outputs {num_outputs} classes, expected '
+                             f'{" or ".join(map(str, sorted(expected)))}; re-export it to match '
+                             f'{names_path} and LABEL_INDEX')
+        if self.label_index is not None:
+            if num_outputs == len(self.classes):
+                self.logit_columns = np.asarray(self.label_index.classes, dtype=np.int64)
+            self.classes = tuple(self.classes[idx] for idx in self.label_index.classes)
+            self.class_taxa = self.label_index.class_taxa
+
+    def preprocess(self, img):
+        """Resize + ToTensor + Normalize, matching `Inference.transform_img`, as a (3, S, S) float32 array."""
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img = img.resize((self.img_size, self.img_size), Image.BILINEAR)
+        arr = np.asarray(img, dtype=np.float32) / 255.0
+        arr = (arr - IMAGENET_DEFAULT_MEAN) / IMAGENET_DEFAULT_STD
+        return arr.transpose(2, 0, 1)
+
+    def forward(self, batch):
+        logits = self.session.run(None, {self.input_name: batch})[0]
+        return logits if self.logit_columns is None else logits[:, self.logit_columns]
+
+    def warmup(self, batch_size=1):
+        """Run one forward pass on a blank batch to let onnxruntime allocate its buffers."""
+        self.forward(np.zeros((batch_size, 3, self.img_size, self.img_size), dtype=np.float32))
+
+    def topk_predictions(self, logits, topk=None):
+        """Softmax + top-k of a (B, num_classes) logits array as one TopK per row."""
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+        k = probs.shape[1] if topk is None else min(topk, probs.shape[1])
+        if k < probs.shape[1]:
+            # Partition first so only k scores per row are sorted
+            indices = np.argpartition(-probs, k - 1, axis=1)[:, :k]
+        else:
+            indices = np.broadcast_to(np.arange(probs.shape[1]), probs.shape)
+        scores = np.take_along_axis(probs, indices, axis=1)
+        order = np.argsort(-scores, axis=1, kind='stable')
+        indices = np.take_along_axis(indices, order, axis=1).astype(np.int64)
+        scores = np.take_along_axis(scores, order, axis=1).astype(np.float32)
+        return [TopK(row_indices, row_scores) for row_indices, row_scores in zip(indices, scores)]
+
+    def label_scores(self, pred):
+        """Expand a compact TopK into an ordered `{label: score}` dict."""
+        return {self.classes[idx]: score for idx, score in zip(pred.indices.tolist(), pred.scores.tolist())}
+
+    def infer_batch(self, images, topk=None, meta_data_path=None, compact=False, timings=None):
+        """Classify a list of PIL images in one run; same results as `Inference.infer_batch`.
+
+        `meta_data_path` is accepted for compatibility; exported graphs are image-only.
+        """
+        start = time.perf_counter()
+        batch = np.stack([self.preprocess(img) for img in images])
+        preprocessed = time.perf_counter()
+        logits = self.forward(batch)
+        forwarded = time.perf_counter()
+        preds = self.topk_predictions(logits, topk)
+        if not compact:
+            preds = [self.label_scores(pred) for pred in preds]
+        if timings is not None:
+            timings.update(preprocess=preprocessed - start, forward=forwarded - preprocessed,
+                           postprocess=time.perf_counter() - forwarded)
+        return preds
@@ -0,0 +1,157 @@
+"""
+Content-addressed cache for `/predict` results.
+
+Entries are keyed by a hash of the image bytes plus the model identity and `top_k`,
+so the same observation photo classified on upload, by `suggest-identification`
+and again later is only run through the model once. The in-memory tier is a bounded
+LRU with a TTL; the optional SQLite tier survives worker restarts and is shared by
+every worker pointing at the same file.
+
+Memory lookups never touch SQLite, so they are safe on the event loop; `get_disk` and
+`put` block on SQLite and belong in a worker thread.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+log = logging.getLogger("inat-vision-service.cache")
+
+
+class PredictionCache:
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 86400.0,
+                 db_path: Optional[str] = None, max_db_entries: int = 100000):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.max_db_entries = max_db_entries
+        self.db_path = db_path
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        # _lock guards the in-memory tier only; SQLite calls hold _db_lock, never both
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._db_writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _conn(self):
+        """SQLite connection for this process, opened on first use.
+
+        SQLite handles must not cross a fork, so forked workers (serve.py) each open their own.
+        """
+        if self.db_path is None:
+            return None
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._db_pid = os.getpid()
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS predictions '
+                             '(key TEXT PRIMARY KEY, created_at REAL NOT NULL, value TEXT NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS predictions_created_at ON predictions (created_at)')
+            log.info('Prediction cache persisted to %s', self.db_path)
+        return self._db
+
+    @staticmethod
+    def make_key(image_bytes, model_id: str, top_k: Optional[int]) -> str:
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f'{model_id}\0{top_k}\0'.encode('utf-8'))
+        h.update(image_bytes)
+        return h.hexdigest()
+
+    @property
+    def persistent(self) -> bool:
+        return self.db_path is not None
+
+    def get(self, key: str) -> Optional[Any]:
+        """Memory, then SQLite lookup; blocking when persistent (see `get_memory` / `get_disk`)."""
+        value = self.get_memory(key)
+        if value is None and self.persistent:
+            value = self.get_disk(key)
+        return value
+
+    def get_memory(self, key: str) -> Optional[Any]:
+        """In-memory lookup only; never blocks on SQLite. A miss counts only without a SQLite tier."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                del self._entries[key]
+            if not self.persistent:
+                self.misses += 1
+        return None
+
+    def get_disk(self, key: str) -> Optional[Any]:
+        """SQLite lookup after a `get_memory` miss (blocking); a hit is promoted to memory."""
+        now = time.time()
+        with self._db_lock:
+            db = self._conn()
+            row = db.execute('SELECT created_at, value FROM predictions WHERE key = ?', (key,)).fetchone()
+        value = None
+        if row is not None and row[0] + self.ttl > now:
+            value = json.loads(row[1])
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self._remember(key, value, row[0] + self.ttl)
+                self.disk_hits += 1
+        return value
+
+    def put(self, key: str, value: Any):
+        """Store a JSON-serialisable value; the SQLite write is blocking, so call from a worker thread."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now + self.ttl)
+        if not self.persistent:
+            return
+        encoded = json.dumps(value)
+        with self._db_lock:
+            db = self._conn()
+            db.execute('INSERT OR REPLACE INTO predictions (key, created_at, value) VALUES (?, ?, ?)',
+                       (key, now, encoded))
+            self._db_writes += 1
+            # Prune expired and overflow rows every so often rather than on each write
+            if self._db_writes % 256 == 0:
+                db.execute('DELETE FROM predictions WHERE created_at < ?', (now - self.ttl,))
+                db.execute('DELETE FROM predictions WHERE key IN (SELECT key FROM predictions '
+                           'ORDER BY created_at DESC LIMIT -1 OFFSET ?)', (self.max_db_entries,))
+
+    def _remember(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                'hits': hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'persistent': self.persistent,
+            }
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None and self._db_pid == os.getpid():
+                self._db.close()
+            self._db = None
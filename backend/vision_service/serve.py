@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Multi-process launcher for the vision service.
+
+`uvicorn --workers N` starts N independent interpreters, each of which loads its own
+copy of the MetaFG weights. This launcher instead loads the model once in the parent,
+moves the weights into shared memory and forks N uvicorn workers that all accept on the
+same listening socket and serve from that single copy.
+
+Each worker sizes its torch thread pools to its share of the CPU budget (affinity mask
+capped by the cgroup quota). With `--pin-cpus` each worker is also pinned to its own
+contiguous set of cores, so workers never compete for a core or migrate between them; under
+a quota only that many cores are handed out.
+
+Usage:
+    python serve.py --workers 4 --port 8000 --pin-cpus
+
+Environment:
+    VISION_WORKERS       default worker count (1)
+    SHARED_WEIGHTS       set to 0 to skip share_memory() and rely on copy-on-write only
+                         (memory-mapped weights never need it)
+    WARMUP_ITERATIONS    warm-up forward passes each worker runs before accepting requests
+    PIN_WORKER_CPUS      set to 1 for --pin-cpus
+    PROMETHEUS_MULTIPROC_DIR
+                         empty directory for per-worker metric files, so /metrics reports
+                         all workers combined; clear it before each start
+
+Dead workers are restarted; SIGTERM/SIGINT stop all workers.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+import app as service
+import metrics
+from cpu_tuning import affinity_cpus, available_cpus, pin_to_cpus, worker_cpus
+
+log = logging.getLogger("inat-vision-service.serve")
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description='Serve the vision service from N forked workers sharing one model')
+    ap.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    ap.add_argument('--port', type=int, default=int(os.environ.get('PORT', '8000')))
+    ap.add_argument('--workers', type=int, default=int(os.environ.get('VISION_WORKERS', '1')))
+    ap.add_argument('--pin-cpus', action='store_true',
+                    default=os.environ.get('PIN_WORKER_CPUS', '').lower() in ('1', 'true', 'yes'),
+                    help='pin each worker to its own slice of the available cores')
+    ap.add_argument('--log-level', default='info')
+    return ap.parse_args()
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(worker_id, sock, args):
+    """Body of a forked worker: warm up on the shared model, then serve until signalled."""
+    log.info('Worker %d (pid %d) starting', worker_id, os.getpid())
+    # Slice only as many cores as the cgroup quota pays for; threads on the rest would just be throttled
+    cpus = worker_cpus(worker_id, args.workers, affinity_cpus()[:available_cpus()]) if args.pin_cpus else None
+    if cpus and pin_to_cpus(cpus):
+        log.info('Worker %d pinned to CPUs %s', worker_id, ','.join(map(str, cpus)))
+        service.configure_threads(len(cpus))
+    else:
+        service.configure_threads(max(1, available_cpus() // args.workers))
+    if service.inference_model is None and not service.mock_mode_enabled():
+        service.preload_model(share_memory=False)
+    if service.WARMUP_ITERATIONS > 0 and not service.mock_mode_enabled():
+        service.warm_up_model(service.WARMUP_ITERATIONS)
+    config = uvicorn.Config(service.app, log_level=args.log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn(worker_id, sock, args):
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    # Child: restore default signal handling (uvicorn installs its own) and never return
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 0
+    try:
+        run_worker(worker_id, sock, args)
+    except Exception:
+        log.exception('Worker %d crashed', worker_id)
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def main():
+    args = parse_args()
+    if args.workers < 1:
+        print('--workers must be >= 1')
+        return 2
+
+    sock = bind_socket(args.host, args.port)
+    # onnxruntime sessions are not fork-safe (their thread pools don't survive fork), so with
+    # INFERENCE_BACKEND=onnx each worker opens its own session after forking
+    if not service.mock_mode_enabled() and service.INFERENCE_BACKEND == 'torch':
+        # Load before forking so every worker maps the same weights
+        share = os.environ.get('SHARED_WEIGHTS', '1').lower() not in ('0', 'false', 'no')
+        service.preload_model(share_memory=share)
+
+    stopping = False
+    children = {}
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for worker_id in range(args.workers):
+        children[spawn(worker_id, sock, args)] = worker_id
+    log.info('Serving on %s:%d with %d workers', args.host, args.port, args.workers)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        worker_id = children.pop(pid, None)
+        metrics.mark_process_dead(pid)
+        if worker_id is None or stopping:
+            continue
+        log.warning('Worker %d (pid %d) exited with status %d; restarting', worker_id, pid, status)
+        time.sleep(1)
+        children[spawn(worker_id, sock, args)] = worker_id
+
+    sock.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())